@@ -2,9 +2,12 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_wtf import CSRFProtect
+import copy
 import os
 from dotenv import load_dotenv
 
+from .sqlite_tuning import DEFAULT_ENGINE_OPTIONS, DEFAULT_PRAGMAS, apply_profile
+
 
 # Load environment variables from a .env file if present. This allows the
 # application to retrieve email credentials and other configuration values
@@ -16,13 +19,98 @@ login_manager = LoginManager()
 csrf = CSRFProtect()
 
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_mapping(
         SECRET_KEY='devkey',
         SQLALCHEMY_DATABASE_URI='sqlite:///../instance/passes.db',
-        SQLALCHEMY_TRACK_MODIFICATIONS=False
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        # Set ``SCHEMA_AUTO_MIGRATE=0`` to apply schema upgrades only through
+        # ``flask db-upgrade``.
+        SCHEMA_AUTO_MIGRATE=os.getenv('SCHEMA_AUTO_MIGRATE', '1') != '0',
+        # WAL journal, busy timeout and cache settings applied to every SQLite
+        # connection. Set ``SQLITE_TUNING=0`` to run with SQLite's defaults.
+        SQLITE_TUNING=os.getenv('SQLITE_TUNING', '1') != '0',
+        SQLITE_PRAGMAS=dict(DEFAULT_PRAGMAS),
+        # Event listings show upcoming events plus those that ended within
+        # ``EVENT_LIST_RECENT_DAYS``; older ones are in the archive view.
+        EVENT_LIST_PAGE_SIZE=30,
+        EVENT_LIST_RECENT_DAYS=7,
+        # Queued emails are delivered by a background thread in each web
+        # worker; set ``EMAIL_OUTBOX_WORKER=0`` when running
+        # ``flask outbox-worker`` as a separate process instead.
+        EMAIL_OUTBOX_WORKER=os.getenv('EMAIL_OUTBOX_WORKER', '1') != '0',
+        EMAIL_OUTBOX_POLL_SECONDS=30,
+        EMAIL_OUTBOX_BATCH_SIZE=50,
+        EMAIL_OUTBOX_MAX_ATTEMPTS=8,
+        EMAIL_OUTBOX_RETRY_SECONDS=60,
+        EMAIL_OUTBOX_MAX_RETRY_SECONDS=3600,
+        EMAIL_OUTBOX_LEASE_SECONDS=300,
+        # Where emails go: ``smtp`` (the server below), ``file`` (``.eml``
+        # files in ``EMAIL_SPOOL_DIR``) or ``memory`` (kept in the process),
+        # see ``app.email_backends``.
+        EMAIL_BACKEND=os.getenv('EMAIL_BACKEND', 'smtp'),
+        EMAIL_SPOOL_DIR=os.getenv(
+            'EMAIL_SPOOL_DIR', os.path.join(app.instance_path, 'mail_spool')
+        ),
+        # Outgoing mail server. Batch senders keep one authenticated session
+        # open for up to ``SMTP_MAX_MESSAGES_PER_CONNECTION`` messages.
+        SMTP_HOST=os.getenv('SMTP_HOST', 'smtp.gmail.com'),
+        SMTP_PORT=int(os.getenv('SMTP_PORT', '465')),
+        SMTP_USE_SSL=os.getenv('SMTP_USE_SSL', '1') != '0',
+        SMTP_STARTTLS=os.getenv('SMTP_STARTTLS', '0') != '0',
+        SMTP_TIMEOUT=30,
+        SMTP_MAX_MESSAGES_PER_CONNECTION=100,
+        # How long a process trusts its cached ``EmailSettings`` before
+        # checking whether another process saved new ones.
+        EMAIL_SETTINGS_CACHE_SECONDS=5,
+        # Scheduled notification batches are sent from a pool of
+        # ``EMAIL_DISPATCH_WORKERS`` threads, each with its own SMTP session,
+        # within a token-bucket limit that keeps under the provider's quota.
+        EMAIL_DISPATCH_WORKERS=4,
+        EMAIL_RATE_LIMIT_PER_SECOND=float(os.getenv('EMAIL_RATE_LIMIT_PER_SECOND', '5')),
+        EMAIL_RATE_LIMIT_BURST=10,
+        # Notification runs commit their progress every
+        # ``NOTIFICATION_CHUNK_SIZE`` registrations and hold a lease that
+        # expires after ``NOTIFICATION_LEASE_SECONDS`` without progress.
+        NOTIFICATION_CHUNK_SIZE=200,
+        NOTIFICATION_LEASE_SECONDS=600,
+        # Combine each user's pending reminder, deduction and thank-you
+        # emails into a single email per run.
+        NOTIFICATION_DIGEST=os.getenv('NOTIFICATION_DIGEST', '0') != '0',
+        # Reminder emails are due this many hours before the event starts.
+        EVENT_REMINDER_LEAD_HOURS=24,
+        # Seats freed by cancellations are filled from the waitlist by a
+        # background thread of each web worker; with ``WAITLIST_WORKER=0``
+        # the cancelling request promotes them itself. A promotion holds
+        # the event's lease for at most ``WAITLIST_LEASE_SECONDS``.
+        WAITLIST_WORKER=os.getenv('WAITLIST_WORKER', '1') != '0',
+        WAITLIST_LEASE_SECONDS=60,
+        WAITLIST_RETRY_SECONDS=1,
+        # Write transactions that hit a locked database (such as two signups
+        # racing for the last seat) are retried up to ``DB_BUSY_RETRIES``
+        # times with an exponential backoff starting at this many seconds.
+        DB_BUSY_RETRIES=5,
+        DB_BUSY_RETRY_DELAY=0.05,
+        # The notification tasks run on these intervals from an in-process
+        # scheduler; one web worker becomes the leader and schedules them.
+        # Set ``SCHEDULER_ENABLED=0`` to rely on ``flask run-scheduler`` or
+        # the cron scripts instead.
+        SCHEDULER_ENABLED=os.getenv('SCHEDULER_ENABLED', '1') != '0',
+        SCHEDULER_REMINDER_MINUTES=5,
+        SCHEDULER_DEDUCTION_MINUTES=60,
+        SCHEDULER_THANK_YOU_MINUTES=60,
+        SCHEDULER_WAITLIST_MINUTES=5,
+        SCHEDULER_MISFIRE_GRACE_SECONDS=3600,
+        SCHEDULER_LEADER_RETRY_SECONDS=60,
     )
+    # Overrides for scripts that run the app against another database.
+    if config:
+        app.config.update(config)
+    if app.config['SQLITE_TUNING']:
+        app.config.setdefault(
+            'SQLALCHEMY_ENGINE_OPTIONS', copy.deepcopy(DEFAULT_ENGINE_OPTIONS)
+        )
 
     db.init_app(app)
     login_manager.init_app(app)
@@ -39,202 +127,41 @@ def create_app():
     app.register_blueprint(admin_bp)
     app.register_blueprint(event_bp)
 
-    # Ensure the database and required tables exist. Without this, a new
-    # deployment would raise ``OperationalError`` when a route queries a
-    # table that hasn't been created yet, resulting in a 500 error.
-    #
-    # ``db.create_all()`` only creates tables that do not already exist and
-    # does not add new columns to existing tables. The application recently
-    # introduced a ``color`` column on the ``Event`` model which older
-    # databases may lack. Attempting to query such a database causes a
-    # ``sqlite3.OperationalError: no such column: event.color`` and results in
-    # a 500 error when the calendar page is opened.  To provide a smooth
-    # upgrade path without requiring a manual migration step, check for the
-    # column and add it if missing.
+    # Ensure the database schema exists and is current. Upgrades are tracked
+    # with ``PRAGMA user_version`` (see ``app.migrations``), so booting against
+    # an up-to-date database costs a single integer read.
+    from .migrations import ensure_schema
+
     with app.app_context():
-        db.create_all()
-
-        # ``PRAGMA table_info`` returns the columns of the given table.  When
-        # the ``color`` column is absent, execute an ``ALTER TABLE`` statement
-        # to add it with the default value ``'blue'`` so existing rows remain
-        # valid and future queries succeed.
-        # SQLAlchemy 2 removed the ``Engine.execute`` helper.  Use an explicit
-        # connection so this code works on newer versions while remaining
-        # compatible with SQLAlchemy 1.x.
-        from sqlalchemy import text
-
-        # Use a dedicated connection so ``PRAGMA`` and ``ALTER`` statements work
-        # consistently across SQLAlchemy 1.x and 2.x.
-        from .models import PendingUser
-
-        with db.engine.connect() as conn:
-            # Older databases created before the introduction of the
-            # ``password_plain`` and ``weekly_reminder_opt_in`` columns on the
-            # ``user`` table will raise ``sqlite3.OperationalError`` when
-            # SQLAlchemy attempts to insert values for the missing fields. This
-            # manifests as a 500 error when a new user registers. Ensure the
-            # columns exist so the registration flow works on upgraded
-            # installations without a manual migration step.
-            insp = conn.execute(text("PRAGMA table_info(user)"))
-            columns = [row[1] for row in insp]
-            if 'password_plain' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE user ADD COLUMN password_plain VARCHAR(150)"
-                    )
-                )
-            if 'weekly_reminder_opt_in' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE user ADD COLUMN weekly_reminder_opt_in BOOLEAN DEFAULT 0"
-                    )
-                )
-            # Older databases also pre-date the introduction of the
-            # ``is_blacklisted`` flag. Without the column every query against the
-            # ``user`` table raises ``sqlite3.OperationalError: no such column:
-            # user.is_blacklisted`` which prevented administrators from logging
-            # in. Ensure the column exists so role checks work reliably.
-            if 'is_blacklisted' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE user ADD COLUMN is_blacklisted BOOLEAN DEFAULT 0"
-                    )
-                )
-            insp.close()
-
-            insp = conn.execute(text("PRAGMA table_info(event)"))
-            columns = [row[1] for row in insp]
-            if 'color' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE event ADD COLUMN color VARCHAR(20) DEFAULT 'blue'"
-                    )
-                )
-            if 'price' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE event ADD COLUMN price NUMERIC(10, 2)"
-                    )
-                )
-            if 'image_path' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE event ADD COLUMN image_path VARCHAR(255)"
-                    )
-                )
-            if 'is_final_event' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE event ADD COLUMN is_final_event BOOLEAN DEFAULT 0"
-                    )
-                )
-            insp.close()
-
-            insp = conn.execute(text("PRAGMA table_info(email_settings)"))
-            columns = [row[1] for row in insp]
-            if 'event_signup_user_enabled' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN event_signup_user_enabled BOOLEAN DEFAULT 0"
-                    )
-                )
-            if 'event_signup_user_text' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN event_signup_user_text TEXT"
-                    )
-                )
-            if 'event_signup_admin_enabled' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN event_signup_admin_enabled BOOLEAN DEFAULT 0"
-                    )
-                )
-            if 'event_signup_admin_text' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN event_signup_admin_text TEXT"
-                    )
-                )
-            if 'event_unregister_user_enabled' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN event_unregister_user_enabled BOOLEAN DEFAULT 0"
-                    )
-                )
-            if 'event_unregister_user_text' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN event_unregister_user_text TEXT"
-                    )
-                )
-            if 'event_unregister_admin_enabled' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN event_unregister_admin_enabled BOOLEAN DEFAULT 0"
-                    )
-                )
-            if 'event_unregister_admin_text' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN event_unregister_admin_text TEXT"
-                    )
-                )
-            if 'event_reminder_enabled' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN event_reminder_enabled BOOLEAN DEFAULT 0"
-                    )
-                )
-            if 'event_reminder_text' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN event_reminder_text TEXT"
-                    )
-                )
-            if 'event_thank_you_enabled' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN event_thank_you_enabled BOOLEAN DEFAULT 0"
-                    )
-                )
-            if 'event_thank_you_text' not in columns:
-                conn.execute(
-                    text(
-                        "ALTER TABLE email_settings ADD COLUMN event_thank_you_text TEXT"
-                    )
-                )
-            # Legacy weekly reminder columns are intentionally not created on new
-            # installations now that the feature has been removed.
-            insp.close()
-
-            insp = conn.execute(text("PRAGMA table_info(event_registration)"))
-            columns = [row[1] for row in insp]
-            registration_columns = {
-                'registration_type': "ALTER TABLE event_registration ADD COLUMN registration_type VARCHAR(20) DEFAULT 'single'",
-                'status': "ALTER TABLE event_registration ADD COLUMN status VARCHAR(20) DEFAULT 'active'",
-                'pass_id': "ALTER TABLE event_registration ADD COLUMN pass_id INTEGER REFERENCES pass(id)",
-                'pass_usage_id': "ALTER TABLE event_registration ADD COLUMN pass_usage_id INTEGER REFERENCES pass_usage(id)",
-                'created_at': "ALTER TABLE event_registration ADD COLUMN created_at DATETIME",
-                'cancelled_at': "ALTER TABLE event_registration ADD COLUMN cancelled_at DATETIME",
-                'is_late_cancel': "ALTER TABLE event_registration ADD COLUMN is_late_cancel BOOLEAN DEFAULT 0",
-                'waitlist_promoted': "ALTER TABLE event_registration ADD COLUMN waitlist_promoted BOOLEAN DEFAULT 0",
-                'reminder_sent': "ALTER TABLE event_registration ADD COLUMN reminder_sent BOOLEAN DEFAULT 0",
-                'pass_deduction_notified': "ALTER TABLE event_registration ADD COLUMN pass_deduction_notified BOOLEAN DEFAULT 0",
-                'thank_you_sent': "ALTER TABLE event_registration ADD COLUMN thank_you_sent BOOLEAN DEFAULT 0",
-            }
-            for column_name, statement in registration_columns.items():
-                if column_name not in columns:
-                    conn.execute(text(statement))
-            insp.close()
-
-            # The introduction of the ``PendingUser`` model adds a new table to
-            # the schema. Existing installations that created their database
-            # before this change would otherwise raise
-            # ``sqlite3.OperationalError: no such table: pending_user`` when a
-            # visitor submits the registration form.  Using ``checkfirst`` ensures
-            # that the table is only created when it's actually missing so fresh
-            # installs remain unaffected.
-            PendingUser.__table__.create(bind=conn, checkfirst=True)
+        if app.config['SQLITE_TUNING']:
+            apply_profile(db.engine, app.config['SQLITE_PRAGMAS'])
+        ensure_schema(app)
+
+    if app.config['EMAIL_OUTBOX_WORKER']:
+        from .outbox import start_worker_thread
+
+        # Started with the first request rather than here so CLI commands and
+        # the cron scripts, which also call ``create_app``, don't run it.
+        @app.before_request
+        def _start_outbox_worker():
+            start_worker_thread(app)
+
+    if app.config['WAITLIST_WORKER']:
+        from .waitlist import start_worker_thread as start_waitlist_thread
+
+        @app.before_request
+        def _start_waitlist_worker():
+            start_waitlist_thread(app)
+
+    if app.config['SCHEDULER_ENABLED']:
+        from .scheduler import start_scheduler_thread
+
+        @app.before_request
+        def _start_scheduler():
+            start_scheduler_thread(app)
+
+    from .cli import register_commands
+
+    register_commands(app)
 
     return app
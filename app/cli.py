@@ -0,0 +1,216 @@
+"""Maintenance commands available through ``flask <command>``."""
+
+from datetime import date, datetime, timedelta
+import threading
+
+import click
+
+from . import db
+from .migrations import current_version, latest_version, upgrade
+from .models import (
+    EmailOutbox,
+    Event,
+    EventRegistration,
+    EventWaitlist,
+    Pass,
+    PassRequest,
+    PassUsage,
+    User,
+    available_passes,
+    recount_active_registrations,
+)
+from .outbox import deliver_pending, run_worker
+from .read_models import event_page
+from .scheduler import become_leader
+from .smtp_sink import SMTPSink
+from .utils import user_prefix_filter
+
+
+def _known_queries():
+    """Return ``(label, statement)`` pairs mirroring the application's lookups."""
+    now = datetime.utcnow()
+    today = date.today()
+    return [
+        (
+            'registration by event, user and status',
+            db.select(EventRegistration).filter_by(
+                event_id=1, user_id=1, status='active'
+            ),
+        ),
+        (
+            'registrations by user and status',
+            db.select(EventRegistration).filter_by(user_id=1, status='active'),
+        ),
+        (
+            'registration history of a user',
+            db.select(EventRegistration)
+            .filter_by(user_id=1)
+            .order_by(EventRegistration.created_at.desc()),
+        ),
+        (
+            'waitlist head of an event',
+            db.select(EventWaitlist)
+            .filter_by(event_id=1)
+            .order_by(EventWaitlist.created_at),
+        ),
+        (
+            'waitlist entries of a user',
+            db.select(EventWaitlist).filter_by(user_id=1),
+        ),
+        (
+            'valid passes of a user',
+            db.select(Pass).where(Pass.user_id == 1, Pass.end_date >= today),
+        ),
+        (
+            'best available pass of a user',
+            available_passes(1, today).limit(1),
+        ),
+        (
+            'latest usage of a pass',
+            db.select(PassUsage)
+            .filter_by(pass_id=1)
+            .order_by(PassUsage.used_on.desc()),
+        ),
+        (
+            'pending pass requests',
+            db.select(PassRequest)
+            .filter_by(status='pending')
+            .order_by(PassRequest.created_at),
+        ),
+        (
+            'pending pass request of a user',
+            db.select(PassRequest).filter_by(user_id=1, status='pending'),
+        ),
+        (
+            'user picker prefix search',
+            db.select(User).where(user_prefix_filter('ann')).limit(10),
+        ),
+        (
+            'events in calendar order',
+            db.select(Event).order_by(Event.start_time),
+        ),
+        (
+            'upcoming events page',
+            event_page(cursor=f'{now.isoformat()}_1').events_query,
+        ),
+        (
+            'archived events page',
+            event_page(archive=True, cursor=f'{now.isoformat()}_1').events_query,
+        ),
+        (
+            'event reminders due',
+            db.select(EventRegistration)
+            .join(Event)
+            .where(
+                EventRegistration.reminder_due_at <= now,
+                EventRegistration.status == 'active',
+                EventRegistration.reminder_sent.is_(False),
+            ),
+        ),
+        (
+            'due outbox emails',
+            db.select(EmailOutbox.id)
+            .where(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now)
+            .order_by(EmailOutbox.next_attempt_at, EmailOutbox.id),
+        ),
+        (
+            'recently finished events',
+            db.select(EventRegistration)
+            .join(Event)
+            .where(
+                Event.end_time <= now,
+                Event.end_time >= now - timedelta(hours=36),
+                EventRegistration.status == 'active',
+            ),
+        ),
+    ]
+
+
+def _full_scans(statement):
+    """Return the ``EXPLAIN QUERY PLAN`` lines that scan a whole table."""
+    compiled = statement.compile(dialect=db.engine.dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup or ())
+    with db.engine.connect() as conn:
+        rows = conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params)
+        details = [row[-1] for row in rows]
+    # ``SCAN <table> USING [COVERING] INDEX`` walks an index in order and is
+    # fine; a bare ``SCAN <table>`` reads every row of the table.
+    return [
+        detail
+        for detail in details
+        if detail.startswith('SCAN ') and 'USING' not in detail
+    ]
+
+
+def register_commands(app):
+    @app.cli.command('db-upgrade')
+    def db_upgrade():
+        """Apply pending schema migrations."""
+        version = upgrade(db.engine)
+        click.echo(f'Adatbázis séma verzió: {version}')
+
+    @app.cli.command('db-version')
+    def db_version():
+        """Show the current and the latest schema version."""
+        with db.engine.connect() as conn:
+            version = current_version(conn)
+        click.echo(f'Jelenlegi: {version}, legfrissebb: {latest_version()}')
+
+    @app.cli.command('recount-registrations')
+    def recount_registrations():
+        """Recompute the cached active registration count of every event."""
+        recount_active_registrations()
+        db.session.commit()
+        click.echo('Aktív jelentkezések száma újraszámolva.')
+
+    @app.cli.command('outbox-worker')
+    @click.option('--once', is_flag=True, help='Deliver the due emails and exit.')
+    def outbox_worker(once):
+        """Deliver queued emails from the outbox."""
+        if once:
+            click.echo(f'Feldolgozott e-mailek: {deliver_pending()}')
+            return
+        run_worker(app)
+
+    @app.cli.command('smtp-sink')
+    @click.option('--host', default='127.0.0.1', show_default=True)
+    @click.option('--port', default=1025, show_default=True)
+    @click.option('--latency', default=0.0, help='Delay of every reply in seconds.')
+    def smtp_sink(host, port, latency):
+        """Run a local SMTP server that accepts and discards every email."""
+        sink = SMTPSink(host, port, latency)
+        click.echo(
+            f'SMTP sink: {host}:{port} '
+            f'(SMTP_HOST={host} SMTP_PORT={port} SMTP_USE_SSL=0), leállítás: Ctrl+C.'
+        )
+        try:
+            sink.serve_forever()
+        except KeyboardInterrupt:
+            click.echo(f'Fogadott üzenetek: {sink.messages}')
+        finally:
+            sink.server_close()
+
+    @app.cli.command('run-scheduler')
+    def run_scheduler():
+        """Run the notification scheduler in the foreground."""
+        click.echo('Várakozás az ütemező zárolására...')
+        scheduler = become_leader(app)
+        click.echo('Az ütemező fut, leállítás: Ctrl+C.')
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            scheduler.shutdown()
+
+    @app.cli.command('check-query-plans')
+    def check_query_plans():
+        """Fail when a known lookup falls back to a full table scan."""
+        failures = 0
+        for label, statement in _known_queries():
+            scans = _full_scans(statement)
+            if scans:
+                failures += 1
+                click.echo(f'FAIL {label}: {"; ".join(scans)}')
+            else:
+                click.echo(f'ok   {label}')
+        if failures:
+            raise click.ClickException(f'{failures} lekérdezés teljes táblát olvas.')
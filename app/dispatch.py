@@ -0,0 +1,134 @@
+"""Concurrent, rate-limited delivery of a batch of emails.
+
+``dispatch_emails`` sends a list of prepared messages from a small thread
+pool. Every worker thread keeps its own transport, so with the SMTP backend
+the pool is also a pool of authenticated SMTP sessions. One token bucket per
+process (``rate_limiter``) caps the overall send rate at
+``EMAIL_RATE_LIMIT_PER_SECOND`` with bursts of up to
+``EMAIL_RATE_LIMIT_BURST`` messages, so the provider's quota holds no matter
+how many workers run or how many chunks a notification run is split into.
+
+Workers never touch the database or the app context: credentials and
+settings are resolved before the pool starts, and the per-message results
+are returned so the caller can update its rows.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional
+
+from flask import current_app
+
+from .email_backends import transport_from_config
+from .utils import build_email_message, credentials_configured, email_credentials
+
+
+class EmailJob(NamedTuple):
+    subject: str
+    html_content: str
+    to_email: str
+
+
+class TokenBucket:
+    """Thread-safe token bucket; ``acquire`` blocks until a token is free."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# Keyed by ``(rate, burst)`` so apps with different limits in one process
+# do not share a bucket.
+_buckets: dict = {}
+_buckets_lock = threading.Lock()
+
+
+def rate_limiter(config) -> TokenBucket:
+    """Return this process's token bucket for the configured send rate.
+
+    Every ``dispatch_emails`` call draws from the same bucket, so a run sent
+    in several chunks does not get a fresh burst for each of them.
+    """
+    key = (config['EMAIL_RATE_LIMIT_PER_SECOND'], config['EMAIL_RATE_LIMIT_BURST'])
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = _buckets[key] = TokenBucket(*key)
+    return bucket
+
+
+def dispatch_emails(
+    jobs: List[EmailJob],
+    workers: Optional[int] = None,
+    bucket: Optional[TokenBucket] = None,
+) -> List[bool]:
+    """Send ``jobs`` concurrently and return a success flag for each, in order.
+
+    Sends are paced by ``bucket``, by default the process-wide
+    ``rate_limiter``. Must be called inside an app context. Failures are
+    logged and reported as ``False``; they never raise.
+    """
+    if not jobs:
+        return []
+    config = current_app.config
+    email_from, email_password = email_credentials()
+    if not credentials_configured(email_from, email_password):
+        logging.error('Email credentials are not configured.')
+        return [False] * len(jobs)
+
+    workers = max(1, min(workers or config['EMAIL_DISPATCH_WORKERS'], len(jobs)))
+    bucket = bucket or rate_limiter(config)
+    local = threading.local()
+    transports = []
+    transports_lock = threading.Lock()
+
+    def _transport():
+        transport = getattr(local, 'transport', None)
+        if transport is None:
+            transport = transport_from_config(config, email_from, email_password)
+            local.transport = transport
+            with transports_lock:
+                transports.append(transport)
+        return transport
+
+    def _send(job: EmailJob) -> bool:
+        message = build_email_message(
+            job.subject, job.html_content, email_from, job.to_email
+        )
+        bucket.acquire()
+        try:
+            _transport().send(message)
+            return True
+        except Exception as exc:
+            logging.error('Failed to send email to %s: %s', job.to_email, exc)
+            return False
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='email') as pool:
+            return list(pool.map(_send, jobs))
+    finally:
+        for transport in transports:
+            transport.close()
@@ -0,0 +1,97 @@
+"""Interchangeable email backends selected with ``EMAIL_BACKEND``.
+
+Every backend is a transport with the interface of ``SMTPTransport``:
+``send(message)``, ``close()`` and use as a context manager, so
+``send_email``, ``smtp_batch`` and ``dispatch_emails`` work with any of them.
+
+``smtp``
+    The configured mail server (``SMTP_HOST``, ``SMTP_PORT``, ...). Point
+    it at ``flask smtp-sink`` to exercise the full SMTP path offline.
+``file``
+    Writes every message as an ``.eml`` file into ``EMAIL_SPOOL_DIR``.
+``memory``
+    Appends every message to ``sent_messages`` in this process.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import List
+
+from .smtp_transport import SMTPTransport
+
+
+# Messages sent through the ``memory`` backend, oldest first.
+sent_messages: List = []
+_sent_lock = threading.Lock()
+
+
+class _Transport(ABC):
+    """Base for the local backends, which have no session to keep open."""
+
+    @abstractmethod
+    def send(self, message) -> None:
+        """Deliver ``message``, an ``EmailMessage``."""
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class MemoryTransport(_Transport):
+    def send(self, message) -> None:
+        with _sent_lock:
+            sent_messages.append(message)
+
+
+class FileSpoolTransport(_Transport):
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def send(self, message) -> None:
+        name = f'{time.time_ns()}-{uuid.uuid4().hex[:8]}.eml'
+        path = os.path.join(self.directory, name)
+        # Write under a temporary name first, so a reader polling the
+        # directory never sees a half-written message.
+        with open(f'{path}.tmp', 'wb') as handle:
+            handle.write(message.as_bytes())
+        os.replace(f'{path}.tmp', path)
+
+
+def clear_sent_messages() -> None:
+    with _sent_lock:
+        sent_messages.clear()
+
+
+BACKENDS = {
+    'smtp': SMTPTransport.from_config,
+    'file': lambda config, username, password: FileSpoolTransport(
+        config['EMAIL_SPOOL_DIR']
+    ),
+    'memory': lambda config, username, password: MemoryTransport(),
+}
+
+
+def transport_from_config(config, username=None, password=None):
+    """Return a new transport of the configured ``EMAIL_BACKEND``."""
+    backend = config['EMAIL_BACKEND']
+    try:
+        factory = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f'Unknown EMAIL_BACKEND: {backend!r}') from None
+    return factory(config, username, password)
+
+
+def requires_login(config) -> bool:
+    """Whether the configured backend needs the sender's password."""
+    return config['EMAIL_BACKEND'] == 'smtp'
@@ -1,98 +1,154 @@
-def base_email_template(title: str, content: str) -> str:
-    return f"""
+"""Email contents as structured ``(title, body)`` pairs.
+
+The functions below return an ``EmailContent`` whose body is ``Markup``:
+every interpolated value is HTML-escaped by ``Markup.format``.
+``render_email`` turns it into the final HTML with one pass of a Jinja
+layout that is compiled once per process.
+"""
+
+from typing import NamedTuple
+
+from jinja2 import Environment
+from markupsafe import Markup, escape
+
+
+class EmailContent(NamedTuple):
+    title: str
+    body: Markup
+
+
+_LAYOUT = Environment(autoescape=True).from_string(
+    """
     <html>
       <body style='font-family: Arial, sans-serif; background-color: #f5f5f5; padding: 20px;'>
         <div style='max-width: 600px; margin: auto; background: white; padding: 30px; border-radius: 8px;'>
-          <h2 style='color: #2c3e50;'>{title}</h2>
-          <p style='color: #333;'>{content}</p>
+          <h2 style='color: #2c3e50;'>{{ title }}</h2>
+          <p style='color: #333;'>{{ body }}</p>
           <hr>
           <small style='color: #999;'>Ez egy automatikus üzenet a Bérletkezelő Rendszertől.</small>
         </div>
       </body>
     </html>
     """
+)
 
-def registration_email(username: str, password: str) -> str:
-    content = f"Kedves {username},<br><br>Felhasználónév: {username}<br>Jelszó: {password}<br>"
-    return base_email_template("Fiók létrehozva", content)
 
+def render_email(content: EmailContent) -> str:
+    """Return the HTML email for ``content``."""
+    return _LAYOUT.render(title=content.title, body=content.body)
 
-def registration_confirmation_email(username: str, confirmation_url: str) -> str:
-    content = (
-        f"Kedves {username},<br><br>"
-        "A regisztráció befejezéséhez kattints az alábbi linkre:<br>"
-        f"<a href='{confirmation_url}'>{confirmation_url}</a><br><br>"
-        "Ha nem te kezdeményezted a regisztrációt, kérjük hagyd figyelmen kívül ezt az üzenetet."
+
+def text_to_markup(text: str) -> Markup:
+    """Escape plain ``text`` (such as a custom settings text), keeping its line breaks."""
+    return Markup("<br>").join(escape(line) for line in text.splitlines())
+
+
+def with_custom_text(content: EmailContent, custom: Markup, append: bool = False) -> EmailContent:
+    """Return ``content`` with ``custom`` added before or after its body."""
+    parts = (content.body, custom) if append else (custom, content.body)
+    return content._replace(body=Markup("<br><br>").join(parts))
+
+
+def notification_digest_email(username: str, sections) -> EmailContent:
+    """Return one email combining several ``EmailContent`` notifications."""
+    parts = Markup("<br><hr><br>").join(
+        Markup("<strong>{}</strong><br>{}").format(section.title, section.body)
+        for section in sections
     )
-    return base_email_template("Regisztráció megerősítése", content)
+    body = Markup("Kedves {},<br><br>{}").format(username, parts)
+    return EmailContent("Értesítések", body)
 
 
-def forgot_password_email(username: str, password: str) -> str:
-    content = (
-        f"Kedves {username},<br><br>"
-        f"A kért jelszó: {password}<br>"
+def registration_email(username: str, password: str) -> EmailContent:
+    body = Markup("Kedves {},<br><br>Felhasználónév: {}<br>Jelszó: {}<br>").format(
+        username, username, password
     )
-    return base_email_template("Elfelejtett jelszó", content)
+    return EmailContent("Fiók létrehozva", body)
+
+
+def registration_confirmation_email(username: str, confirmation_url: str) -> EmailContent:
+    body = Markup(
+        "Kedves {username},<br><br>"
+        "A regisztráció befejezéséhez kattints az alábbi linkre:<br>"
+        "<a href='{url}'>{url}</a><br><br>"
+        "Ha nem te kezdeményezted a regisztrációt, kérjük hagyd figyelmen kívül ezt az üzenetet."
+    ).format(username=username, url=confirmation_url)
+    return EmailContent("Regisztráció megerősítése", body)
+
+
+def forgot_password_email(username: str, password: str) -> EmailContent:
+    body = Markup(
+        "Kedves {},<br><br>"
+        "A kért jelszó: {}<br>"
+    ).format(username, password)
+    return EmailContent("Elfelejtett jelszó", body)
+
+
+def user_deleted_email(username: str) -> EmailContent:
+    return EmailContent("Felhasználó törölve", Markup("{} törölve.").format(username))
 
-def _pass_details(p) -> str:
+
+def _pass_details(p) -> Markup:
     """Return a HTML snippet describing the given ``Pass``."""
-    comment = f"<br>Megjegyzés: {p.comment}" if p.comment else ""
-    return (
-        f"Bérlet típusa: {p.type}<br>"
-        f"Érvényesség: {p.start_date} - {p.end_date}<br>"
-        f"Felhasználás: {p.used}/{p.total_uses}{comment}"
-    )
+    comment = Markup("<br>Megjegyzés: {}").format(p.comment) if p.comment else ""
+    return Markup(
+        "Bérlet típusa: {}<br>"
+        "Érvényesség: {} - {}<br>"
+        "Felhasználás: {}/{}{}"
+    ).format(p.type, p.start_date, p.end_date, p.used, p.total_uses, comment)
 
 
-def pass_created_email(p) -> str:
-    """Return the email HTML for a newly created pass."""
-    return base_email_template("Új bérlet létrehozva", _pass_details(p))
+def pass_created_email(p) -> EmailContent:
+    """Return the email for a newly created pass."""
+    return EmailContent("Új bérlet létrehozva", _pass_details(p))
 
-def pass_deleted_email(username: str, pass_type: str, start, end, used) -> str:
-    content = f"Törölt bérlet: {pass_type}<br>{start} - {end}<br>Felhasználva: {used} alkalom"
-    return base_email_template("Bérlet törölve", content)
+def pass_deleted_email(username: str, pass_type: str, start, end, used) -> EmailContent:
+    body = Markup("Törölt bérlet: {}<br>{} - {}<br>Felhasználva: {} alkalom").format(
+        pass_type, start, end, used
+    )
+    return EmailContent("Bérlet törölve", body)
 
 
-def pass_used_email(p, event=None) -> str:
-    """Return the email HTML when a pass usage changes."""
+def pass_used_email(p, event=None) -> EmailContent:
+    """Return the email when a pass usage changes."""
     remaining = p.total_uses - p.used
     if event:
-        intro = (
+        intro = Markup(
             "Lezárult az alábbi esemény, és egy alkalom levonásra került a bérletedből.<br>"
-            f"{_event_details(event)}<br><br>"
-        )
+            "{}<br><br>"
+        ).format(_event_details(event))
     else:
-        intro = f"Felhasználtál egy alkalmat a(z) {p.type} bérletedből.<br>"
-    content = (
-        f"Kedves {p.user.username},<br>"
-        f"{intro}"
-        f"Hátralévő alkalmak: {remaining}.<br><br>"
-        f"{_pass_details(p)}"
-    )
-    return base_email_template("Bérlet használat", content)
-
-
-def pass_usage_reverted_email(p) -> str:
-    """Return the email HTML when a pass usage is undone."""
+        intro = Markup("Felhasználtál egy alkalmat a(z) {} bérletedből.<br>").format(p.type)
+    body = Markup(
+        "Kedves {},<br>"
+        "{}"
+        "Hátralévő alkalmak: {}.<br><br>"
+        "{}"
+    ).format(p.user.username, intro, remaining, _pass_details(p))
+    return EmailContent("Bérlet használat", body)
+
+
+def pass_usage_reverted_email(p) -> EmailContent:
+    """Return the email when a pass usage is undone."""
     remaining = p.total_uses - p.used
-    content = (
-        f"Kedves {p.user.username},<br>"
-        f"Visszakaptál egy alkalmat a(z) {p.type} bérletedbe.<br>"
-        f"Hátralévő alkalmak: {remaining}.<br><br>"
-        f"{_pass_details(p)}"
-    )
-    return base_email_template("Bérlethasználat visszavonva", content)
+    body = Markup(
+        "Kedves {},<br>"
+        "Visszakaptál egy alkalmat a(z) {} bérletedbe.<br>"
+        "Hátralévő alkalmak: {}.<br><br>"
+        "{}"
+    ).format(p.user.username, p.type, remaining, _pass_details(p))
+    return EmailContent("Bérlethasználat visszavonva", body)
 
 
-def _event_details(e) -> str:
+def _event_details(e) -> Markup:
     """Return a HTML snippet describing an ``Event``."""
-    return (
-        f"Esemény: {e.name}<br>"
-        f"Időpont: {e.formatted_time}"
-    )
+    return Markup(
+        "Esemény: {}<br>"
+        "Időpont: {}"
+    ).format(e.name, e.formatted_time)
 
 
-def event_signup_user_email(username: str, e, from_waitlist: bool = False) -> str:
+def event_signup_user_email(username: str, e, from_waitlist: bool = False) -> EmailContent:
     if from_waitlist:
         intro = (
             "Felszabadult egy hely a várólistán szereplő eseményen, így automatikusan "
@@ -101,45 +157,45 @@ def event_signup_user_email(username: str, e, from_waitlist: bool = False) -> st
     else:
         intro = "Sikeresen jelentkeztél a következő eseményre:<br>"
 
-    content = (
-        f"Kedves {username},<br><br>"
-        f"{intro}"
-        f"{_event_details(e)}"
-    )
-    return base_email_template("Esemény jelentkezés", content)
+    body = Markup(
+        "Kedves {},<br><br>"
+        + intro
+        + "{}"
+    ).format(username, _event_details(e))
+    return EmailContent("Esemény jelentkezés", body)
 
 
-def event_waitlist_join_email(username: str, e) -> str:
-    """Return the email HTML confirming a waitlist registration."""
+def event_waitlist_join_email(username: str, e) -> EmailContent:
+    """Return the email confirming a waitlist registration."""
 
-    content = (
-        f"Kedves {username},<br><br>"
+    body = Markup(
+        "Kedves {},<br><br>"
         "Felkerültél a következő esemény várólistájára:<br>"
-        f"{_event_details(e)}"
+        "{}"
         "<br><br>Amint felszabadul egy hely, e-mailben értesítünk."
-    )
-    return base_email_template("Várólista jelentkezés", content)
+    ).format(username, _event_details(e))
+    return EmailContent("Várólista jelentkezés", body)
 
 
-def event_waitlist_removed_email(username: str, e) -> str:
-    """Return the email HTML when an admin removes a waitlist entry."""
+def event_waitlist_removed_email(username: str, e) -> EmailContent:
+    """Return the email when an admin removes a waitlist entry."""
 
-    content = (
-        f"Kedves {username},<br><br>"
+    body = Markup(
+        "Kedves {},<br><br>"
         "Az admin eltávolított a következő esemény várólistájáról:<br>"
-        f"{_event_details(e)}"
+        "{}"
         "<br><br>Ha további kérdésed van, lépj kapcsolatba velünk."
-    )
-    return base_email_template("Várólista eltávolítás", content)
+    ).format(username, _event_details(e))
+    return EmailContent("Várólista eltávolítás", body)
 
 
-def event_signup_admin_email(username: str, e) -> str:
-    content = (
-        f"Kedves {username},<br><br>"
-        f"Az admin regisztrált a következő eseményre:<br>"
-        f"{_event_details(e)}"
-    )
-    return base_email_template("Esemény jelentkezés", content)
+def event_signup_admin_email(username: str, e) -> EmailContent:
+    body = Markup(
+        "Kedves {},<br><br>"
+        "Az admin regisztrált a következő eseményre:<br>"
+        "{}"
+    ).format(username, _event_details(e))
+    return EmailContent("Esemény jelentkezés", body)
 
 
 def event_unregister_user_email(
@@ -148,65 +204,64 @@ def event_unregister_user_email(
     used_pass: bool = False,
     late_cancel: bool = False,
     deduction_kept: bool = False,
-) -> str:
-    """Return the email HTML when a user unregisters from an event."""
-    content = (
-        f"Kedves {username},<br><br>"
-        f"Sikeresen leiratkoztál a következő eseményről:<br>"
-        f"{_event_details(e)}"
-    )
+) -> EmailContent:
+    """Return the email when a user unregisters from an event."""
     if used_pass:
         if deduction_kept:
             deduction_text = "Az alkalom levonva marad a bérletedből."
         else:
             deduction_text = "Az alkalmat visszaadtuk a bérletedhez."
-        content += (
-            f"<br><br>{deduction_text}"
-        )
     else:
-        content += (
-            "<br><br>A lemondáshoz nem használtál bérletet, így nem történt levonás."
-        )
-    return base_email_template("Esemény leiratkozás", content)
+        deduction_text = "A lemondáshoz nem használtál bérletet, így nem történt levonás."
+    body = Markup(
+        "Kedves {},<br><br>"
+        "Sikeresen leiratkoztál a következő eseményről:<br>"
+        "{}"
+        "<br><br>{}"
+    ).format(username, _event_details(e), deduction_text)
+    return EmailContent("Esemény leiratkozás", body)
 
 
-def event_reminder_email(e) -> str:
+def event_reminder_email(e) -> EmailContent:
     """Return the reminder email sent 24 hours before an event."""
-    content = (
+    body = Markup(
         "1 nap múlva kezdődik az esemény amire jelentkeztél.<br><br>"
-        f"{_event_details(e)}"
-    )
-    return base_email_template("Esemény emlékeztető", content)
+        "{}"
+    ).format(_event_details(e))
+    return EmailContent("Esemény emlékeztető", body)
 
 
-def event_thank_you_email(username: str, e) -> str:
+def event_thank_you_email(username: str, e) -> EmailContent:
     """Return the thank you email sent after an event has finished."""
-    content = (
-        f"Kedves {username},<br><br>"
-        f"Köszönjük, hogy részt vettél a(z) {e.name} eseményen.<br>"
+    body = Markup(
+        "Kedves {},<br><br>"
+        "Köszönjük, hogy részt vettél a(z) {} eseményen.<br>"
         "Várunk vissza a következő alkalommal is!<br><br>"
-        f"{_event_details(e)}"
-    )
-    return base_email_template("Köszönjük a részvételt", content)
+        "{}"
+    ).format(username, e.name, _event_details(e))
+    return EmailContent("Köszönjük a részvételt", body)
 
 
-def event_unregister_admin_email(username: str, e) -> str:
-    """Return the email HTML when an admin removes a user from an event."""
-    content = (
-        f"Kedves {username},<br><br>"
-        f"Az admin törölte a jelentkezésed a következő eseményről:<br>"
-        f"{_event_details(e)}"
-    )
-    return base_email_template("Esemény leiratkozás", content)
+def event_unregister_admin_email(username: str, e) -> EmailContent:
+    """Return the email when an admin removes a user from an event."""
+    body = Markup(
+        "Kedves {},<br><br>"
+        "Az admin törölte a jelentkezésed a következő eseményről:<br>"
+        "{}"
+    ).format(username, _event_details(e))
+    return EmailContent("Esemény leiratkozás", body)
 
 
-def pass_request_admin_email(user, pass_request) -> str:
-    """Return the email HTML sent to admins when a new pass request arrives."""
-    content = (
-        "Új bérlet igénylés érkezett.<br><br>"
-        f"Felhasználó: {user.username}<br>"
-        f"Email: {user.email}<br>"
-        f"Igényelt bérlet: {pass_request.display_type}<br>"
-        f"Igénylés ideje: {pass_request.created_at.strftime('%Y-%m-%d %H:%M') if pass_request.created_at else '-'}"
+def pass_request_admin_email(user, pass_request) -> EmailContent:
+    """Return the email sent to admins when a new pass request arrives."""
+    created = (
+        pass_request.created_at.strftime('%Y-%m-%d %H:%M') if pass_request.created_at else '-'
     )
-    return base_email_template("Új bérlet igénylés", content)
+    body = Markup(
+        "Új bérlet igénylés érkezett.<br><br>"
+        "Felhasználó: {}<br>"
+        "Email: {}<br>"
+        "Igényelt bérlet: {}<br>"
+        "Igénylés ideje: {}"
+    ).format(user.username, user.email, pass_request.display_type, created)
+    return EmailContent("Új bérlet igénylés", body)
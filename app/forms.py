@@ -22,6 +22,7 @@ from wtforms.validators import (
     Optional,
     ValidationError,
 )
+from wtforms.widgets import HiddenInput
 import re
 
 try:
@@ -70,7 +71,10 @@ class PassForm(FlaskForm):
     start_date = DateField('Kezdő dátum', validators=[DataRequired()])
     end_date = DateField('Lejárati dátum', validators=[DataRequired()])
     total_uses = IntegerField('Alkalmak száma', validators=[DataRequired(), NumberRange(min=1)])
-    user_id = SelectField('Felhasználó', coerce=int, validators=[DataRequired()])
+    # Filled in by the typeahead picker (see ``static/js/user_picker.js``);
+    # ``user_search`` holds the visible username as a fallback.
+    user_id = IntegerField(widget=HiddenInput(), validators=[Optional()])
+    user_search = StringField('Felhasználó', validators=[DataRequired()])
     comment = TextAreaField('Megjegyzés')
     submit = SubmitField('Bérlet létrehozása')
 
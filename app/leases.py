@@ -0,0 +1,105 @@
+"""Database leases that keep a background job to a single running copy.
+
+Unlike ``app.locking.file_lock`` a lease works across hosts and frees itself
+when its holder dies: it simply expires unless the holder renews it.
+"""
+
+from __future__ import annotations
+
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import JobLease
+
+
+class LeaseLost(RuntimeError):
+    """Raised by ``Lease.renew`` when another process took over the lease."""
+
+
+class Lease:
+    def __init__(self, name: str, seconds: float):
+        self.name = name
+        self.duration = timedelta(seconds=seconds)
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+    def _owned(self):
+        return db.and_(JobLease.name == self.name, JobLease.owner == self.owner)
+
+    def acquire(self) -> bool:
+        """Take the lease if it is free or expired; commits the session."""
+        now = datetime.utcnow()
+        result = db.session.execute(
+            db.update(JobLease)
+            .where(
+                JobLease.name == self.name,
+                db.or_(JobLease.expires_at < now, JobLease.owner == self.owner),
+            )
+            .values(owner=self.owner, expires_at=now + self.duration),
+            execution_options={'synchronize_session': False},
+        )
+        if result.rowcount == 0:
+            db.session.add(
+                JobLease(name=self.name, owner=self.owner, expires_at=now + self.duration)
+            )
+            try:
+                db.session.flush()
+            except IntegrityError:
+                db.session.rollback()
+                return False
+        db.session.commit()
+        return True
+
+    def renew(self) -> None:
+        """Extend the lease; raise ``LeaseLost`` if it is no longer ours."""
+        result = db.session.execute(
+            db.update(JobLease)
+            .where(self._owned())
+            .values(expires_at=datetime.utcnow() + self.duration),
+            execution_options={'synchronize_session': False},
+        )
+        db.session.commit()
+        if result.rowcount == 0:
+            raise LeaseLost(self.name)
+
+    def release(self) -> None:
+        db.session.execute(db.delete(JobLease).where(self._owned()))
+        db.session.commit()
+
+
+def acquire_lease(name: str, seconds: float) -> Optional[Lease]:
+    """Return a held ``Lease`` for ``name``, or ``None`` if another run has it."""
+    lease = Lease(name, seconds)
+    return lease if lease.acquire() else None
+
+
+class LeaseSet:
+    """Several leases held together, renewed and released as one."""
+
+    def __init__(self, leases):
+        self.leases = list(leases)
+
+    def renew(self) -> None:
+        for lease in self.leases:
+            lease.renew()
+
+    def release(self) -> None:
+        for lease in self.leases:
+            lease.release()
+
+
+def acquire_leases(names, seconds: float) -> Optional[LeaseSet]:
+    """Acquire every lease in ``names`` or none of them."""
+    held = []
+    for name in names:
+        lease = acquire_lease(name, seconds)
+        if lease is None:
+            LeaseSet(held).release()
+            return None
+        held.append(lease)
+    return LeaseSet(held)
@@ -0,0 +1,73 @@
+"""Inter-process locks backed by lock files next to the database."""
+
+from contextlib import contextmanager
+import os
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+    import msvcrt
+
+
+def _lock(handle, blocking: bool = True) -> None:
+    if fcntl:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        fcntl.flock(handle.fileno(), flags)
+    else:
+        handle.seek(0)
+        mode = msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK
+        msvcrt.locking(handle.fileno(), mode, 1)
+
+
+def _unlock(handle) -> None:
+    if fcntl:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+    else:
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def database_lock_path(engine, name: str) -> Optional[str]:
+    """Return the ``<database>.<name>.lock`` path, or ``None`` without a file.
+
+    An in-memory database belongs to a single process, so there is nothing
+    to guard against.
+    """
+    database = engine.url.database
+    if not database or database == ':memory:':
+        return None
+    return f'{database}.{name}.lock'
+
+
+@contextmanager
+def file_lock(path: str):
+    """Hold an exclusive lock on ``path`` for the duration of the block.
+
+    The lock is released by the operating system if the process dies, so a
+    crashed worker never leaves it stuck.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a+') as handle:
+        _lock(handle)
+        try:
+            yield
+        finally:
+            _unlock(handle)
+
+
+def try_lock(path: str):
+    """Take an exclusive lock on ``path`` without waiting.
+
+    Returns the open lock file, which holds the lock until it is closed or
+    the process exits, or ``None`` if another process has it.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    handle = open(path, 'a+')
+    try:
+        _lock(handle, blocking=False)
+    except OSError:
+        handle.close()
+        return None
+    return handle
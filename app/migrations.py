@@ -0,0 +1,241 @@
+"""Versioned schema upgrades tracked with SQLite's ``PRAGMA user_version``.
+
+Each migration is registered with an increasing version number and runs at
+most once per database. ``PRAGMA user_version`` stores the version of the last
+applied migration, so a process starting against an up-to-date database only
+reads a single integer instead of inspecting every table.
+
+Migrations run either through ``flask db-upgrade`` or automatically on boot
+(unless ``SCHEMA_AUTO_MIGRATE`` is disabled). In both cases they are guarded by
+a file lock next to the database so parallel workers never race each other's
+``ALTER TABLE`` statements.
+"""
+
+from contextlib import nullcontext
+from datetime import datetime
+import logging
+import os
+
+from flask import current_app
+from sqlalchemy import text
+
+from . import db
+from . import models  # noqa: F401  (registers every table on ``db.metadata``)
+from .locking import database_lock_path, file_lock
+
+
+MIGRATIONS = []
+
+
+def migration(version: int, description: str):
+    """Register ``func`` as the schema upgrade producing ``version``."""
+
+    def decorator(func):
+        if MIGRATIONS and version <= MIGRATIONS[-1][0]:
+            raise ValueError(f'Migration {version} is out of order.')
+        MIGRATIONS.append((version, description, func))
+        return func
+
+    return decorator
+
+
+def latest_version() -> int:
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(conn) -> int:
+    return conn.execute(text('PRAGMA user_version')).scalar() or 0
+
+
+def _columns(conn, table: str) -> set:
+    return {row[1] for row in conn.execute(text(f'PRAGMA table_info({table})'))}
+
+
+def _add_columns(conn, table: str, columns: dict) -> list:
+    """Add every missing column of ``columns`` (name -> DDL) to ``table``.
+
+    ``db.create_all`` builds new tables from the current models, so on a fresh
+    database these columns already exist and the statements are skipped.
+    Returns the names of the columns that were actually added.
+    """
+    existing = _columns(conn, table)
+    added = []
+    for name, ddl in columns.items():
+        if name not in existing:
+            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {ddl}'))
+            added.append(name)
+    return added
+
+
+def _create_missing_indexes(conn) -> None:
+    """Create declared indexes that are missing from existing tables.
+
+    ``create_all`` only creates indexes together with their table, so
+    databases created before an index was declared never receive it.
+    """
+    # Look the names up in ``sqlite_master`` rather than using
+    # ``checkfirst``: reflection skips expression-based indexes.
+    existing = {
+        row[0]
+        for row in conn.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'index'")
+        )
+    }
+    for table in db.metadata.sorted_tables:
+        columns = _columns(conn, table.name)
+        for index in table.indexes:
+            # An index on a column that a later migration adds is created by
+            # that migration.
+            if index.name not in existing and all(
+                column.name in columns for column in index.columns
+            ):
+                index.create(bind=conn)
+
+
+@migration(1, 'Baseline schema with the legacy column upgrades')
+def _baseline(conn):
+    # Databases created before the migration registry existed may lack any
+    # of the columns introduced over time. Without them SQLAlchemy raises
+    # ``sqlite3.OperationalError: no such column`` (for example
+    # ``event.color`` on the calendar page or ``user.is_blacklisted`` on
+    # login), so add every missing one with a default that keeps existing
+    # rows valid. ``create_all`` also covers the ``PendingUser`` table and
+    # any other table missing from older installations.
+    db.metadata.create_all(bind=conn)
+
+    _add_columns(conn, 'user', {
+        'password_plain': 'VARCHAR(150)',
+        'weekly_reminder_opt_in': 'BOOLEAN DEFAULT 0',
+        'is_blacklisted': 'BOOLEAN DEFAULT 0',
+    })
+
+    added = _add_columns(conn, 'event', {
+        'color': "VARCHAR(20) DEFAULT 'blue'",
+        'price': 'NUMERIC(10, 2)',
+        'image_path': 'VARCHAR(255)',
+        'is_final_event': 'BOOLEAN DEFAULT 0',
+        'active_count': 'INTEGER NOT NULL DEFAULT 0',
+    })
+    # ``active_count`` caches the number of active registrations so
+    # ``Event.spots_left`` does not need to load the relationship.
+    if 'active_count' in added:
+        conn.execute(
+            text(
+                "UPDATE event SET active_count = ("
+                "SELECT COUNT(*) FROM event_registration "
+                "WHERE event_registration.event_id = event.id "
+                "AND event_registration.status = 'active')"
+            )
+        )
+
+    # Legacy weekly reminder columns are intentionally not created on new
+    # installations now that the feature has been removed.
+    _add_columns(conn, 'email_settings', {
+        'event_signup_user_enabled': 'BOOLEAN DEFAULT 0',
+        'event_signup_user_text': 'TEXT',
+        'event_signup_admin_enabled': 'BOOLEAN DEFAULT 0',
+        'event_signup_admin_text': 'TEXT',
+        'event_unregister_user_enabled': 'BOOLEAN DEFAULT 0',
+        'event_unregister_user_text': 'TEXT',
+        'event_unregister_admin_enabled': 'BOOLEAN DEFAULT 0',
+        'event_unregister_admin_text': 'TEXT',
+        'event_reminder_enabled': 'BOOLEAN DEFAULT 0',
+        'event_reminder_text': 'TEXT',
+        'event_thank_you_enabled': 'BOOLEAN DEFAULT 0',
+        'event_thank_you_text': 'TEXT',
+    })
+
+    _add_columns(conn, 'event_registration', {
+        'registration_type': "VARCHAR(20) DEFAULT 'single'",
+        'status': "VARCHAR(20) DEFAULT 'active'",
+        'pass_id': 'INTEGER REFERENCES pass(id)',
+        'pass_usage_id': 'INTEGER REFERENCES pass_usage(id)',
+        'created_at': 'DATETIME',
+        'cancelled_at': 'DATETIME',
+        'is_late_cancel': 'BOOLEAN DEFAULT 0',
+        'waitlist_promoted': 'BOOLEAN DEFAULT 0',
+        'reminder_sent': 'BOOLEAN DEFAULT 0',
+        'pass_deduction_notified': 'BOOLEAN DEFAULT 0',
+        'thank_you_sent': 'BOOLEAN DEFAULT 0',
+    })
+
+    # Some indexes cover the columns added above, so create them last.
+    _create_missing_indexes(conn)
+
+
+@migration(2, 'Expression indexes for the user picker search')
+def _user_search_indexes(conn):
+    _create_missing_indexes(conn)
+
+
+@migration(3, 'Email outbox table')
+def _email_outbox(conn):
+    models.EmailOutbox.__table__.create(bind=conn, checkfirst=True)
+
+
+@migration(4, 'Version counter for cached email settings')
+def _email_settings_version(conn):
+    _add_columns(conn, 'email_settings', {'version': 'INTEGER NOT NULL DEFAULT 1'})
+
+
+@migration(5, 'Job lease table for background runs')
+def _job_lease(conn):
+    models.JobLease.__table__.create(bind=conn, checkfirst=True)
+
+
+@migration(6, 'Due time of pending event reminders')
+def _reminder_due_at(conn):
+    _add_columns(conn, 'event_registration', {'reminder_due_at': 'DATETIME'})
+    _create_missing_indexes(conn)
+    # Schedule the reminders still pending for upcoming events with the
+    # configured lead time, as ``models.reminder_due_time`` does.
+    lead_hours = current_app.config['EVENT_REMINDER_LEAD_HOURS']
+    conn.execute(
+        text(
+            "UPDATE event_registration SET reminder_due_at = ("
+            "SELECT datetime(event.start_time, :lead) FROM event "
+            "WHERE event.id = event_registration.event_id) "
+            "WHERE status = 'active' AND reminder_sent = 0 AND event_id IN ("
+            "SELECT id FROM event WHERE start_time > :now)"
+        ),
+        {'lead': f'-{lead_hours} hours', 'now': datetime.utcnow()},
+    )
+
+
+def upgrade(engine) -> int:
+    """Apply every pending migration and return the resulting version."""
+    lock_path = database_lock_path(engine, 'migrate')
+    with file_lock(lock_path) if lock_path else nullcontext():
+        # Another worker may have finished the upgrade while this one was
+        # waiting for the lock, so read the version only once it is held.
+        with engine.begin() as conn:
+            version = current_version(conn)
+            for target, description, func in MIGRATIONS:
+                if target <= version:
+                    continue
+                logging.info('Adatbázis migráció %s: %s', target, description)
+                func(conn)
+                # ``PRAGMA`` does not accept bound parameters.
+                conn.execute(text(f'PRAGMA user_version = {int(target)}'))
+                version = target
+    return version
+
+
+def ensure_schema(app) -> None:
+    """Bring the database schema up to date when ``create_app`` boots."""
+    engine = db.engine
+    database = engine.url.database
+    if database and database != ':memory:':
+        os.makedirs(os.path.dirname(os.path.abspath(database)), exist_ok=True)
+    with engine.connect() as conn:
+        version = current_version(conn)
+    if version >= latest_version():
+        return
+    if not app.config.get('SCHEMA_AUTO_MIGRATE', True):
+        logging.warning(
+            'Az adatbázis séma elavult (%s < %s), futtasd: flask db-upgrade',
+            version,
+            latest_version(),
+        )
+        return
+    upgrade(engine)
@@ -1,5 +1,7 @@
+from flask import current_app
 from flask_login import UserMixin
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from typing import Optional
 from werkzeug.security import generate_password_hash, check_password_hash
 from . import db, login_manager
 
@@ -38,6 +40,13 @@ class User(UserMixin, db.Model):
         return check_password_hash(self.password_hash, password)
 
 
+# Case-insensitive prefix lookups for the admin user picker compare
+# ``lower(username)`` / ``lower(email)`` against a range, which these
+# expression indexes answer without scanning the table.
+db.Index('ix_user_username_lower', db.func.lower(User.username))
+db.Index('ix_user_email_lower', db.func.lower(User.email))
+
+
 class Pass(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     type = db.Column(db.String(100), nullable=False)
@@ -51,12 +60,20 @@ class Pass(db.Model):
         'PassUsage', backref='pass_ref', lazy=True, cascade='all, delete-orphan'
     )
 
+    __table_args__ = (
+        db.Index('ix_pass_user_end_date', 'user_id', 'end_date'),
+    )
+
 
 class PassUsage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     pass_id = db.Column(db.Integer, db.ForeignKey('pass.id'), nullable=False)
     used_on = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_pass_usage_pass_used_on', 'pass_id', 'used_on'),
+    )
+
 
 class PassRequest(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -69,6 +86,11 @@ class PassRequest(db.Model):
 
     pass_ref = db.relationship('Pass')
 
+    __table_args__ = (
+        db.Index('ix_pass_request_status_created_at', 'status', 'created_at'),
+        db.Index('ix_pass_request_user_status', 'user_id', 'status'),
+    )
+
     @property
     def display_type(self) -> str:
         return f"{self.requested_uses} alkalmas bérlet"
@@ -122,6 +144,45 @@ class EmailSettings(db.Model):
     weekly_reminder_day = db.Column(db.Integer, default=0)
     weekly_reminder_time = db.Column(db.Time)
 
+    # Bumped on every save so other processes notice the change with a
+    # single-integer read (see ``app.settings_cache``).
+    version = db.Column(db.Integer, nullable=False, default=1)
+
+
+class EmailOutbox(db.Model):
+    """Email written in the same transaction as the change it reports.
+
+    ``app.outbox`` delivers the rows in the background, retrying failed
+    sends with exponential backoff. ``next_attempt_at`` doubles as the claim
+    lease of the worker currently sending the row.
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255), nullable=False)
+    html_content = db.Column(db.Text, nullable=False)
+    to_email = db.Column(db.Text, nullable=False)
+    # Optional key identifying the business event, so the same notification
+    # is never queued twice.
+    dedupe_key = db.Column(db.String(255), unique=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_email_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+
+class JobLease(db.Model):
+    """Time-limited ownership of a background job (see ``app.leases``)."""
+
+    name = db.Column(db.String(100), primary_key=True)
+    owner = db.Column(db.String(255), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
 
 class PendingUser(db.Model):
     """Temporary storage for users awaiting email verification."""
@@ -152,6 +213,10 @@ class Event(db.Model):
     price = db.Column(db.Numeric(10, 2))
     image_path = db.Column(db.String(255))
     is_final_event = db.Column(db.Boolean, nullable=False, default=False)
+    # Number of registrations with ``status == 'active'``. Maintained by
+    # ``adjust_active_count`` in the same transaction as the registration
+    # change so capacity checks never have to load ``registrations``.
+    active_count = db.Column(db.Integer, nullable=False, default=0)
     registrations = db.relationship(
         'EventRegistration', backref='event', lazy=True, cascade='all, delete-orphan'
     )
@@ -166,6 +231,11 @@ class Event(db.Model):
         'darkblue': '#00008b',
     }
 
+    __table_args__ = (
+        db.Index('ix_event_start_time', 'start_time'),
+        db.Index('ix_event_end_time', 'end_time'),
+    )
+
     @property
     def color_hex(self) -> str:
         """Return the hex color code for the event's color."""
@@ -173,8 +243,7 @@ class Event(db.Model):
 
     @property
     def spots_left(self) -> int:
-        active = [reg for reg in self.registrations if reg.status == 'active']
-        return self.capacity - len(active)
+        return self.capacity - (self.active_count or 0)
 
     @property
     def formatted_time(self) -> str:
@@ -207,6 +276,133 @@ class Event(db.Model):
         return "upcoming"
 
 
+def adjust_active_count(event_id: int, delta: int) -> None:
+    """Shift ``Event.active_count`` by ``delta`` inside the current transaction.
+
+    The increment is issued as ``UPDATE ... SET active_count = active_count +
+    :delta`` so concurrent writers never lose an update, and any ``Event``
+    already loaded in the session is kept in sync.
+    """
+    db.session.execute(
+        db.update(Event)
+        .where(Event.id == event_id)
+        .values(active_count=Event.active_count + delta)
+    )
+
+
+def available_passes(user_id: int, today: Optional[date] = None):
+    """Select the user's valid passes with uses left, soonest expiry first.
+
+    Served by ``ix_pass_user_end_date``: only passes that have not yet
+    expired are read, however many old ones the user has.
+    """
+    today = today or date.today()
+    return (
+        db.select(Pass)
+        .where(
+            Pass.user_id == user_id,
+            Pass.end_date >= today,
+            Pass.start_date <= today,
+            Pass.used < Pass.total_uses,
+        )
+        .order_by(Pass.end_date, Pass.id)
+    )
+
+
+def consume_pass_use(pass_id: int, today: Optional[date] = None) -> Optional['PassUsage']:
+    """Use one occasion of a pass and record it inside the current transaction.
+
+    The check and the increment are a single guarded ``UPDATE pass SET used =
+    used + 1 WHERE id = ? AND used < total_uses AND end_date >= ?``, so
+    concurrent signups and check-ins can neither exceed ``total_uses`` nor
+    lose an increment. Returns the new, flushed ``PassUsage``, or ``None``
+    when the pass is used up or expired.
+    """
+    result = db.session.execute(
+        db.update(Pass)
+        .where(
+            Pass.id == pass_id,
+            Pass.used < Pass.total_uses,
+            Pass.end_date >= (today or date.today()),
+        )
+        .values(used=Pass.used + 1)
+    )
+    if result.rowcount != 1:
+        return None
+    usage = PassUsage(pass_id=pass_id)
+    db.session.add(usage)
+    db.session.flush()
+    return usage
+
+
+def return_pass_use(pass_id: int, usage_id: Optional[int] = None) -> bool:
+    """Give back one occasion of a pass, deleting its ``PassUsage`` if given.
+
+    The counterpart of ``consume_pass_use``: one ``UPDATE ... SET used = used
+    - 1 WHERE used > 0``. Returns ``False`` when the pass had no use to return.
+    """
+    if usage_id is not None:
+        db.session.execute(db.delete(PassUsage).where(PassUsage.id == usage_id))
+    result = db.session.execute(
+        db.update(Pass)
+        .where(Pass.id == pass_id, Pass.used > 0)
+        .values(used=Pass.used - 1)
+    )
+    return result.rowcount == 1
+
+
+def reserve_seat(event_id: int, count: int = 1) -> bool:
+    """Claim ``count`` free seats of the event inside the current transaction.
+
+    The capacity check and the increment are a single conditional ``UPDATE``,
+    so two concurrent signups can never both take the last seat: the second
+    one waits for the write lock and then matches no row. Returns ``False``
+    when fewer than ``count`` seats are free.
+    """
+    result = db.session.execute(
+        db.update(Event)
+        .where(Event.id == event_id, Event.active_count + count <= Event.capacity)
+        .values(active_count=Event.active_count + count)
+    )
+    return result.rowcount == 1
+
+
+def reminder_due_time(start_time: datetime) -> datetime:
+    """Return when the reminder for an event starting at ``start_time`` is due."""
+    return start_time - timedelta(hours=current_app.config['EVENT_REMINDER_LEAD_HOURS'])
+
+
+def reschedule_reminders(event: Event) -> None:
+    """Move the pending reminders of ``event`` to match its start time."""
+    db.session.execute(
+        db.update(EventRegistration)
+        .where(
+            EventRegistration.event_id == event.id,
+            EventRegistration.status == 'active',
+            EventRegistration.reminder_sent.is_(False),
+        )
+        .values(reminder_due_at=reminder_due_time(event.start_time)),
+        execution_options={'synchronize_session': False},
+    )
+
+
+def recount_active_registrations() -> None:
+    """Recompute ``Event.active_count`` for every event from the registrations."""
+    active = (
+        db.select(db.func.count(EventRegistration.id))
+        .where(
+            EventRegistration.event_id == Event.id,
+            EventRegistration.status == 'active',
+        )
+        .scalar_subquery()
+    )
+    db.session.execute(
+        db.update(Event).values(active_count=active),
+        execution_options={'synchronize_session': False},
+    )
+    db.session.expire_all()
+
+
 class EventRegistration(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     event_id = db.Column(db.Integer, db.ForeignKey('event.id'), nullable=False)
@@ -222,7 +418,19 @@ class EventRegistration(db.Model):
     reminder_sent = db.Column(db.Boolean, default=False)
     pass_deduction_notified = db.Column(db.Boolean, default=False)
     thank_you_sent = db.Column(db.Boolean, default=False)
+    # When the reminder email is due; cleared once it is sent or no longer
+    # needed, so the due-reminder lookup only ever sees pending rows.
+    reminder_due_at = db.Column(db.DateTime)
     pass_usage = db.relationship('PassUsage', foreign_keys=[pass_usage_id])
+    pass_ref = db.relationship('Pass')
+
+    __table_args__ = (
+        db.Index(
+            'ix_event_registration_event_user_status', 'event_id', 'user_id', 'status'
+        ),
+        db.Index('ix_event_registration_user_status', 'user_id', 'status'),
+        db.Index('ix_event_registration_reminder_due_at', 'reminder_due_at'),
+    )
 
 
 class EventWaitlist(db.Model):
@@ -241,6 +449,8 @@ class EventWaitlist(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint('event_id', 'user_id', name='uq_event_waitlist_user'),
+        db.Index('ix_event_waitlist_event_created_at', 'event_id', 'created_at'),
+        db.Index('ix_event_waitlist_user', 'user_id'),
     )
 
 
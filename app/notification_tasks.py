@@ -1,157 +1,421 @@
-"""Utility functions for sending scheduled event-related emails."""
+"""Utility functions for sending scheduled event-related emails.
+
+Each task walks its registrations in keyset-ordered chunks and commits the
+notification flags after every chunk, so a run that dies halfway resumes
+where it stopped instead of re-sending everything. ``run_task`` holds a
+database lease per task so overlapping runs, whether from cron, the
+scheduler or both, cannot send the same batch.
+
+With ``NOTIFICATION_DIGEST`` enabled, ``run_digest`` replaces the three
+tasks: every pending notification of a user is combined into one email per
+run, and each covered registration is flagged once that email is sent.
+"""
 
 from __future__ import annotations
 
 import logging
+from collections import defaultdict
 from datetime import datetime, timedelta
+from typing import Callable, NamedTuple
 
 from app.email_templates import (
     event_reminder_email,
     event_thank_you_email,
+    notification_digest_email,
     pass_used_email,
+    render_email,
 )
+from flask import current_app
+from sqlalchemy.orm import contains_eager, joinedload
+
+from app import db
 from app.models import EmailSettings, Event, EventRegistration, Pass
-from app.utils import send_event_email
+from app.dispatch import EmailJob, dispatch_emails
+from app.leases import LeaseLost, acquire_leases
+from app.utils import event_email_content, render_event_email
 
 
-def send_event_reminders(now: datetime, settings: EmailSettings | None) -> int:
-    """Send reminder e-mails for events starting within the next 24 hours."""
+class _Notification(NamedTuple):
+    """One notification type: the registrations it covers and how it renders them."""
 
-    if not settings:
-        logging.info("Nincsenek e-mail beállítások, emlékeztetők kihagyva.")
-        return 0
+    name: str
+    enabled_flag: str
+    no_settings_message: str
+    disabled_message: str
+    # ``now`` -> registration query without load options.
+    query: Callable
+    # ``(registration, now)`` -> ``(event name, subject, EmailContent)``,
+    # or ``None`` when the registration needs no email.
+    render: Callable
+    # Column values recorded once the email went out.
+    sent_values: dict
+
+
+def _event_job(event_name, subject, content, to_email):
+    """Return an ``EmailJob`` for a configurable notification, or ``None``."""
+    html = render_event_email(event_name, content)
+    if html is None:
+        return None
+    return EmailJob(subject, html, to_email)
+
+
+def _delivered(batch):
+    """Send the ``(item, job)`` pairs and yield the items whose email went out."""
+    pending = [(item, job) for item, job in batch if job is not None]
+    results = dispatch_emails([job for _, job in pending])
+    for (item, _), delivered in zip(pending, results):
+        if delivered:
+            yield item
+
+
+def _with_details(query):
+    """Load everything the emails use together with the registrations.
 
-    if not settings.event_reminder_enabled:
-        logging.info(
-            "Esemény emlékeztető funkció letiltva, nincs kiküldendő e-mail."
+    The event comes from the join, the user and the pass (with its owner)
+    are joined eagerly, so rendering a chunk issues no further queries.
+    """
+    return query.options(
+        contains_eager(EventRegistration.event),
+        joinedload(EventRegistration.user),
+        joinedload(EventRegistration.pass_ref).joinedload(Pass.user),
+    )
+
+
+def _checkpoint(lease) -> None:
+    """Persist the flags set so far, clear the session and renew the lease."""
+    db.session.commit()
+    db.session.expunge_all()
+    if lease is not None:
+        lease.renew()
+
+
+def _chunks(query, lease=None):
+    """Yield the registrations matched by ``query`` in chunks, oldest ID first.
+
+    Before loading the next chunk the session is committed, persisting the
+    flags set on the previous one, and cleared so memory use does not grow
+    with the size of the window. The lease, if any, is renewed per chunk.
+    """
+    size = current_app.config["NOTIFICATION_CHUNK_SIZE"]
+    last_id = 0
+    while True:
+        chunk = (
+            _with_details(query)
+            .filter(EventRegistration.id > last_id)
+            .order_by(EventRegistration.id)
+            .limit(size)
+            .all()
         )
-        return 0
+        if not chunk:
+            return
+        last_id = chunk[-1].id
+        yield chunk
+        _checkpoint(lease)
+
 
-    window_end = now + timedelta(hours=24)
-    registrations = (
-        EventRegistration.query.join(Event)
-        .filter(
-            EventRegistration.status == "active",
-            EventRegistration.reminder_sent.is_(False),
-            Event.start_time > now,
-            Event.start_time <= window_end,
+def _mark_sent(notification: _Notification, registrations) -> None:
+    """Flag ``registrations`` as notified with a single ``UPDATE``."""
+    ids = [registration.id for registration in registrations]
+    if ids:
+        db.session.execute(
+            db.update(EventRegistration)
+            .where(EventRegistration.id.in_(ids))
+            .values(**notification.sent_values),
+            execution_options={"synchronize_session": False},
         )
-        .all()
-    )
 
-    if not registrations:
-        logging.info("Nincs kiküldendő esemény emlékeztető e-mail.")
+
+def _is_enabled(notification: _Notification, settings) -> bool:
+    if not settings:
+        logging.info(notification.no_settings_message)
+        return False
+    if not getattr(settings, notification.enabled_flag):
+        logging.info(notification.disabled_message)
+        return False
+    return True
+
+
+def _send_each(notification: _Notification, now: datetime, settings, lease) -> int:
+    """Send one email per registration and return how many were sent."""
+    if not _is_enabled(notification, settings):
         return 0
 
     sent = 0
-    for registration in registrations:
-        event = registration.event
-        user = registration.user
-        if not event or not user or not user.email:
-            continue
-
-        if send_event_email(
-            "event_reminder",
-            "Esemény emlékeztető",
-            event_reminder_email(event),
-            user.email,
-        ):
-            registration.reminder_sent = True
-            sent += 1
+    for registrations in _chunks(notification.query(now), lease):
+        batch = []
+        for registration in registrations:
+            rendered = notification.render(registration, now)
+            user = registration.user
+            if rendered is None or not user or not user.email:
+                continue
+            batch.append((registration, _event_job(*rendered, user.email)))
 
+        delivered = list(_delivered(batch))
+        _mark_sent(notification, delivered)
+        sent += len(delivered)
     return sent
 
 
-def send_pass_deduction_notifications(
-    now: datetime, settings: EmailSettings | None
-) -> int:
-    """Notify users about pass deductions for events that ended recently."""
+def _reminder_query(now: datetime):
+    # Only registrations whose ``reminder_due_at`` has passed are read, so a
+    # run costs as much as the number of due reminders.
+    return EventRegistration.query.join(Event).filter(
+        EventRegistration.reminder_due_at <= now,
+        EventRegistration.status == "active",
+        EventRegistration.reminder_sent.is_(False),
+    )
 
-    if not settings:
-        logging.info("Nincsenek e-mail beállítások, bérlet értesítők kihagyva.")
-        return 0
 
-    if not settings.pass_used_enabled:
-        logging.info("Bérlet levonási értesítők kiküldése letiltva.")
-        return 0
+def _render_reminder(registration, now: datetime):
+    if registration.event.start_time <= now:
+        # Too late for a reminder; drop it from the due queue.
+        registration.reminder_due_at = None
+        return None
+    return (
+        "event_reminder",
+        "Esemény emlékeztető",
+        event_reminder_email(registration.event),
+    )
 
-    window_start = now - timedelta(hours=36)
-    registrations = (
-        EventRegistration.query.join(Event)
-        .filter(
-            Event.end_time <= now,
-            Event.end_time >= window_start,
-            EventRegistration.pass_usage_id.isnot(None),
-            EventRegistration.pass_deduction_notified.is_(False),
-            EventRegistration.status.in_(("active", "late_cancelled")),
-        )
-        .all()
+
+def _deduction_query(now: datetime):
+    return EventRegistration.query.join(Event).filter(
+        Event.end_time <= now,
+        Event.end_time >= now - timedelta(hours=36),
+        EventRegistration.pass_usage_id.isnot(None),
+        EventRegistration.pass_deduction_notified.is_(False),
+        EventRegistration.status.in_(("active", "late_cancelled")),
+    )
+
+
+def _render_deduction(registration, now: datetime):
+    associated_pass = registration.pass_ref
+    if not associated_pass:
+        registration.pass_deduction_notified = True
+        return None
+    return (
+        "pass_used",
+        "Bérlet használat",
+        pass_used_email(associated_pass, registration.event),
+    )
+
+
+def _thank_you_query(now: datetime):
+    return EventRegistration.query.join(Event).filter(
+        Event.end_time <= now,
+        Event.end_time >= now - timedelta(hours=36),
+        EventRegistration.pass_usage_id.is_(None),
+        EventRegistration.thank_you_sent.is_(False),
+        EventRegistration.status == "active",
     )
 
-    sent = 0
-    for registration in registrations:
-        event = registration.event
-        user = registration.user
-        if not event or not user or not user.email:
-            continue
-
-        associated_pass = Pass.query.get(registration.pass_id)
-        if not associated_pass:
-            registration.pass_deduction_notified = True
-            continue
-
-        if send_event_email(
-            "pass_used",
-            "Bérlet használat",
-            pass_used_email(associated_pass, event),
-            user.email,
-        ):
-            registration.pass_deduction_notified = True
-            sent += 1
 
+def _render_thank_you(registration, now: datetime):
+    return (
+        "event_thank_you",
+        "Köszönjük a részvételt",
+        event_thank_you_email(registration.user.username, registration.event),
+    )
+
+
+REMINDERS = _Notification(
+    "reminders",
+    "event_reminder_enabled",
+    "Nincsenek e-mail beállítások, emlékeztetők kihagyva.",
+    "Esemény emlékeztető funkció letiltva, nincs kiküldendő e-mail.",
+    _reminder_query,
+    _render_reminder,
+    {"reminder_sent": True, "reminder_due_at": None},
+)
+DEDUCTIONS = _Notification(
+    "deductions",
+    "pass_used_enabled",
+    "Nincsenek e-mail beállítások, bérlet értesítők kihagyva.",
+    "Bérlet levonási értesítők kiküldése letiltva.",
+    _deduction_query,
+    _render_deduction,
+    {"pass_deduction_notified": True},
+)
+THANK_YOUS = _Notification(
+    "thank_yous",
+    "event_thank_you_enabled",
+    "Nincsenek e-mail beállítások, köszönő üzenetek kihagyva.",
+    "Köszönő e-mailek kiküldése letiltva.",
+    _thank_you_query,
+    _render_thank_you,
+    {"thank_you_sent": True},
+)
+NOTIFICATIONS = (REMINDERS, DEDUCTIONS, THANK_YOUS)
+
+
+def send_event_reminders(
+    now: datetime, settings: EmailSettings | None, lease=None
+) -> int:
+    """Send the reminder e-mails that are due by ``now``.
+
+    A reminder whose event has already started is dropped instead of sent.
+    """
+    sent = _send_each(REMINDERS, now, settings, lease)
+    if not sent:
+        logging.info("Nincs kiküldendő esemény emlékeztető e-mail.")
     return sent
 
 
+def send_pass_deduction_notifications(
+    now: datetime, settings: EmailSettings | None, lease=None
+) -> int:
+    """Notify users about pass deductions for events that ended recently."""
+    return _send_each(DEDUCTIONS, now, settings, lease)
+
+
 def send_event_thank_you_notifications(
-    now: datetime, settings: EmailSettings | None
+    now: datetime, settings: EmailSettings | None, lease=None
 ) -> int:
     """Send thank-you e-mails to attendees without pass usage."""
+    return _send_each(THANK_YOUS, now, settings, lease)
 
-    if not settings:
-        logging.info("Nincsenek e-mail beállítások, köszönő üzenetek kihagyva.")
-        return 0
 
-    if not settings.event_thank_you_enabled:
-        logging.info("Köszönő e-mailek kiküldése letiltva.")
-        return 0
+def _user_chunks(notifications, now: datetime, lease=None):
+    """Yield the IDs of users with pending notifications in chunks, lowest first.
 
-    window_start = now - timedelta(hours=36)
-    registrations = (
-        EventRegistration.query.join(Event)
-        .filter(
-            Event.end_time <= now,
-            Event.end_time >= window_start,
-            EventRegistration.pass_usage_id.is_(None),
-            EventRegistration.thank_you_sent.is_(False),
-            EventRegistration.status == "active",
-        )
-        .all()
+    Like ``_chunks``, progress is committed before the next chunk is read.
+    """
+    size = current_app.config["NOTIFICATION_CHUNK_SIZE"]
+    last_id = 0
+    while True:
+        candidates = set()
+        for notification in notifications:
+            candidates.update(
+                user_id
+                for (user_id,) in notification.query(now)
+                .filter(EventRegistration.user_id > last_id)
+                .with_entities(EventRegistration.user_id)
+                .distinct()
+                .order_by(EventRegistration.user_id)
+                .limit(size)
+            )
+        if not candidates:
+            return
+        user_ids = sorted(candidates)[:size]
+        last_id = user_ids[-1]
+        yield user_ids
+        _checkpoint(lease)
+
+
+def _digest_job(user, items) -> EmailJob:
+    """Return one email for all ``(notification, registration, subject, content)``."""
+    if len(items) == 1:
+        _, _, subject, content = items[0]
+        return EmailJob(subject, render_email(content), user.email)
+    sections = [content for _, _, _, content in items]
+    return EmailJob(
+        f"Értesítések ({len(items)})",
+        render_email(notification_digest_email(user.username, sections)),
+        user.email,
     )
 
-    sent = 0
-    for registration in registrations:
-        event = registration.event
-        user = registration.user
-        if not event or not user or not user.email:
-            continue
-
-        if send_event_email(
-            "event_thank_you",
-            "Köszönjük a részvételt",
-            event_thank_you_email(user.username, event),
-            user.email,
-        ):
-            registration.thank_you_sent = True
-            sent += 1
 
-    return sent
+def send_digests(now: datetime, settings: EmailSettings | None, lease=None) -> dict:
+    """Send every pending notification as one email per user.
+
+    Returns the number of registrations flagged per notification name.
+    """
+    notifications = [n for n in NOTIFICATIONS if _is_enabled(n, settings)]
+    counts = {notification.name: 0 for notification in NOTIFICATIONS}
+
+    for user_ids in _user_chunks(notifications, now, lease):
+        pending = defaultdict(list)
+        users = {}
+        for notification in notifications:
+            registrations = (
+                _with_details(notification.query(now))
+                .filter(EventRegistration.user_id.in_(user_ids))
+                .order_by(EventRegistration.id)
+                .all()
+            )
+            for registration in registrations:
+                rendered = notification.render(registration, now)
+                user = registration.user
+                if rendered is None or not user or not user.email:
+                    continue
+                event_name, subject, content = rendered
+                content = event_email_content(event_name, content)
+                if content is None:
+                    continue
+                users[user.id] = user
+                pending[user.id].append((notification, registration, subject, content))
+
+        batch = [
+            (items, _digest_job(users[user_id], items))
+            for user_id, items in pending.items()
+        ]
+        delivered = defaultdict(list)
+        for items in _delivered(batch):
+            for notification, registration, _, _ in items:
+                delivered[notification.name].append(registration)
+        for notification in NOTIFICATIONS:
+            registrations = delivered[notification.name]
+            _mark_sent(notification, registrations)
+            counts[notification.name] += len(registrations)
+    return counts
+
+
+def _run_leased(names, label: str, func, *args):
+    """Run ``func(*args, lease)`` holding the leases of ``names``.
+
+    Returns ``func``'s result, or ``None`` when another run holds one of
+    the leases or takes it over midway.
+    """
+    lease = acquire_leases(
+        [f"notifications:{name}" for name in names],
+        current_app.config["NOTIFICATION_LEASE_SECONDS"],
+    )
+    if lease is None:
+        logging.warning("Egy másik %s futás még tart, ez a futás kimarad.", label)
+        return None
+    try:
+        result = func(*args, lease)
+        db.session.commit()
+    except LeaseLost:
+        db.session.rollback()
+        logging.error("A %s futás elvesztette a zárolást, leáll.", label)
+        return None
+    except Exception:
+        db.session.rollback()
+        lease.release()
+        raise
+    lease.release()
+    return result
+
+
+TASKS = {
+    "reminders": send_event_reminders,
+    "deductions": send_pass_deduction_notifications,
+    "thank_yous": send_event_thank_you_notifications,
+}
+
+
+def run_task(name: str, now: datetime, settings: EmailSettings | None):
+    """Run one of ``TASKS`` under its own lease.
+
+    Returns the number of emails sent, or ``None`` when another run holds
+    the lease or takes it over midway.
+    """
+    return _run_leased([name], name, TASKS[name], now, settings)
+
+
+def run_digest(now: datetime, settings: EmailSettings | None):
+    """Run ``send_digests`` holding the leases of all three tasks."""
+    return _run_leased(TASKS, "digest", send_digests, now, settings)
+
+
+def run_notifications(now: datetime, settings: EmailSettings | None):
+    """Run every notification once and return ``(reminders, deductions, thank_yous)``.
+
+    Uses digest mode when ``NOTIFICATION_DIGEST`` is set. A task skipped
+    because another run holds its lease reports ``None``.
+    """
+    if current_app.config["NOTIFICATION_DIGEST"]:
+        counts = run_digest(now, settings) or {}
+        return tuple(counts.get(name) for name in TASKS)
+    return tuple(run_task(name, now, settings) for name in TASKS)
@@ -0,0 +1,193 @@
+"""Transactional email outbox and the worker delivering it.
+
+Request handlers call ``queue_email`` / ``queue_event_email`` before they
+commit, so the email is stored atomically with the change it reports and the
+request never waits on SMTP. A group notification is one message to all its
+recipients (``queue_group_email``). ``deliver_pending`` sends due messages,
+retrying failures with exponential backoff; it runs in a background thread
+of every web worker (``EMAIL_OUTBOX_WORKER``) or standalone via
+``flask outbox-worker``.
+"""
+
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from . import db
+from .models import EmailOutbox, User
+from .utils import render_event_email, send_email, smtp_batch
+
+
+_wakeup = threading.Event()
+_worker_lock = threading.Lock()
+_worker_started = False
+
+
+def queue_email(subject, html_content, to_email, dedupe_key=None):
+    """Add an email to the outbox as part of the current transaction.
+
+    Returns the new ``EmailOutbox`` row, or ``None`` when a message with the
+    same ``dedupe_key`` has already been queued.
+    """
+    fields = {'subject': subject, 'html_content': html_content, 'to_email': to_email}
+    if dedupe_key:
+        # Insert right away and let the unique index reject a duplicate, so
+        # two requests queueing the same key at once cannot fail the
+        # transaction the email belongs to.
+        message = db.session.scalar(
+            sqlite_insert(EmailOutbox)
+            .values(dedupe_key=dedupe_key, **fields)
+            .on_conflict_do_nothing(index_elements=['dedupe_key'])
+            .returning(EmailOutbox)
+        )
+        if message is None:
+            return None
+    else:
+        message = EmailOutbox(**fields)
+        db.session.add(message)
+    db.session.info['outbox_queued'] = True
+    return message
+
+
+def queue_event_email(event_name, subject, content, to_email, dedupe_key=None):
+    """Queue a configurable notification unless it is disabled in the settings."""
+    html = render_event_email(event_name, content)
+    if html is None:
+        return None
+    return queue_email(subject, html, to_email, dedupe_key)
+
+
+def queue_group_email(subject, html_content, recipients, dedupe_key=None):
+    """Queue one message addressed to every address in ``recipients``.
+
+    The worker delivers it in a single SMTP transaction, so the cost of a
+    notification does not grow with the size of the group. Returns ``None``
+    when no recipient has an email address.
+    """
+    addresses = sorted({address for address in recipients if address})
+    if not addresses:
+        return None
+    return queue_email(subject, html_content, ', '.join(addresses), dedupe_key)
+
+
+def queue_admin_email(subject, html_content, dedupe_key=None):
+    """Queue a single notification addressed to all administrators."""
+    recipients = db.session.scalars(
+        db.select(User.email).where(User.role == 'admin')
+    ).all()
+    return queue_group_email(subject, html_content, recipients, dedupe_key)
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_worker(session):
+    if session.info.pop('outbox_queued', False):
+        _wakeup.set()
+
+
+def _retry_delay(attempts: int) -> timedelta:
+    config = current_app.config
+    seconds = config['EMAIL_OUTBOX_RETRY_SECONDS'] * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(seconds, config['EMAIL_OUTBOX_MAX_RETRY_SECONDS']))
+
+
+def _claim(message_id: int, now: datetime) -> bool:
+    """Lease a due message to this worker; ``False`` if another one took it."""
+    lease = timedelta(seconds=current_app.config['EMAIL_OUTBOX_LEASE_SECONDS'])
+    result = db.session.execute(
+        db.update(EmailOutbox)
+        .where(
+            EmailOutbox.id == message_id,
+            EmailOutbox.status == 'pending',
+            EmailOutbox.next_attempt_at <= now,
+        )
+        .values(next_attempt_at=now + lease, attempts=EmailOutbox.attempts + 1),
+        execution_options={'synchronize_session': False},
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def deliver_pending(limit=None) -> int:
+    """Send the due outbox messages and return how many were attempted.
+
+    A claimed message stays ``pending`` with ``next_attempt_at`` pushed out
+    by the lease, so a worker that dies mid-send only delays it.
+    """
+    config = current_app.config
+    limit = limit or config['EMAIL_OUTBOX_BATCH_SIZE']
+    now = datetime.utcnow()
+    due = db.session.scalars(
+        db.select(EmailOutbox.id)
+        .where(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now)
+        .order_by(EmailOutbox.next_attempt_at, EmailOutbox.id)
+        .limit(limit)
+    ).all()
+    if not due:
+        return 0
+
+    attempted = 0
+    with smtp_batch():
+        for message_id in due:
+            if not _claim(message_id, now):
+                continue
+            attempted += 1
+            message = db.session.get(EmailOutbox, message_id)
+            if send_email(message.subject, message.html_content, message.to_email):
+                message.status = 'sent'
+                message.sent_at = datetime.utcnow()
+                message.last_error = None
+            else:
+                message.last_error = 'Az e-mail küldése sikertelen.'
+                if message.attempts >= config['EMAIL_OUTBOX_MAX_ATTEMPTS']:
+                    message.status = 'failed'
+                    logging.error(
+                        'Az e-mail végleg sikertelen %s próbálkozás után: %s',
+                        message.attempts,
+                        message.id,
+                    )
+                else:
+                    message.next_attempt_at = datetime.utcnow() + _retry_delay(
+                        message.attempts
+                    )
+            db.session.commit()
+    return attempted
+
+
+def run_worker(app, stop=None) -> None:
+    """Deliver outbox messages until ``stop`` is set.
+
+    Sleeps ``EMAIL_OUTBOX_POLL_SECONDS`` between empty polls unless a commit
+    that queued an email in this process wakes it up earlier.
+    """
+    poll = app.config['EMAIL_OUTBOX_POLL_SECONDS']
+    batch = app.config['EMAIL_OUTBOX_BATCH_SIZE']
+    while not (stop and stop.is_set()):
+        attempted = 0
+        with app.app_context():
+            try:
+                attempted = deliver_pending(batch)
+            except Exception:
+                logging.exception('Az e-mail kézbesítő hibára futott.')
+                db.session.rollback()
+            finally:
+                db.session.remove()
+        if attempted < batch:
+            _wakeup.wait(poll)
+            _wakeup.clear()
+
+
+def start_worker_thread(app) -> None:
+    """Start the background delivery thread once per process."""
+    global _worker_started
+    with _worker_lock:
+        if _worker_started:
+            return
+        _worker_started = True
+    threading.Thread(
+        target=run_worker, args=(app,), name='email-outbox', daemon=True
+    ).start()
@@ -0,0 +1,135 @@
+"""Query-backed read models for pages that list many events at once."""
+
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+from . import db
+from .models import Event, EventRegistration, EventWaitlist
+
+
+class EventListing(NamedTuple):
+    """One event on the user events page together with the user's state."""
+
+    event: Event
+    waitlist_count: int
+    latest_status: Optional[str]
+    on_waitlist: bool
+
+    @property
+    def is_registered(self) -> bool:
+        return self.latest_status == 'active'
+
+
+def event_listings(user_id: int, events_query=None):
+    """Return an ``EventListing`` for every event selected by ``events_query``.
+
+    Everything the page needs is computed in a single statement: capacity
+    comes from ``Event.active_count`` while the waitlist size, the user's
+    latest registration status and waitlist membership are correlated
+    subqueries. Each of them is an index lookup on the event's rows, so the
+    cost depends on the number of listed events only, not on how long the
+    user's registration history is.
+    """
+    waitlist_count = (
+        db.select(db.func.count(EventWaitlist.id))
+        .where(EventWaitlist.event_id == Event.id)
+        .correlate(Event)
+        .scalar_subquery()
+    )
+    # A user has at most one active registration per event and it is always
+    # the most recent one, so the latest row also answers "registered?".
+    latest_status = (
+        db.select(EventRegistration.status)
+        .where(
+            EventRegistration.event_id == Event.id,
+            EventRegistration.user_id == user_id,
+        )
+        .order_by(EventRegistration.created_at.desc(), EventRegistration.id.desc())
+        .limit(1)
+        .correlate(Event)
+        .scalar_subquery()
+    )
+    on_waitlist = (
+        db.select(EventWaitlist.id)
+        .where(EventWaitlist.event_id == Event.id, EventWaitlist.user_id == user_id)
+        .correlate(Event)
+        .exists()
+    )
+
+    if events_query is None:
+        events_query = db.select(Event).order_by(Event.start_time, Event.id)
+    statement = events_query.add_columns(
+        waitlist_count.label('waitlist_count'),
+        latest_status.label('latest_status'),
+        on_waitlist.label('on_waitlist'),
+    )
+    return [
+        EventListing(row[0], row.waitlist_count, row.latest_status, bool(row.on_waitlist))
+        for row in db.session.execute(statement)
+    ]
+
+
+class EventPage(NamedTuple):
+    """The query selecting one page of events and the page size it was built for."""
+
+    events_query: object
+    page_size: int
+
+    def split(self, rows, key=lambda row: row):
+        """Return ``(rows on this page, cursor of the next page or None)``."""
+        if len(rows) <= self.page_size:
+            return rows, None
+        rows = rows[: self.page_size]
+        return rows, encode_cursor(key(rows[-1]))
+
+
+def encode_cursor(event: Event) -> str:
+    return f"{event.start_time.isoformat()}_{event.id}"
+
+
+def decode_cursor(value: Optional[str]):
+    """Return ``(start_time, id)`` from ``encode_cursor`` output, or ``None``."""
+    if not value:
+        return None
+    start, _, event_id = value.rpartition('_')
+    try:
+        return datetime.fromisoformat(start), int(event_id)
+    except ValueError:
+        return None
+
+
+def event_page(
+    archive: bool = False,
+    cursor: Optional[str] = None,
+    page_size: int = 30,
+    recent_days: int = 7,
+    now: Optional[datetime] = None,
+) -> EventPage:
+    """Return a keyset-paginated selection of events.
+
+    By default the listing holds upcoming events plus the ones that ended in
+    the last ``recent_days`` days, oldest first. ``archive`` browses the
+    events before that window, newest first. Pages continue after the
+    ``(start_time, id)`` of the previous page's last event, so every page is
+    an index range scan no matter how far the listing goes back. One row more
+    than ``page_size`` is fetched to tell whether another page follows.
+    """
+    now = now or datetime.now()
+    cutoff = now - timedelta(days=recent_days)
+    position = db.tuple_(Event.start_time, Event.id)
+    after = decode_cursor(cursor)
+
+    query = db.select(Event)
+    if archive:
+        query = query.where(Event.end_time < cutoff).order_by(
+            Event.start_time.desc(), Event.id.desc()
+        )
+        if after:
+            query = query.where(position < after)
+    else:
+        query = query.where(Event.end_time >= cutoff).order_by(
+            Event.start_time, Event.id
+        )
+        if after:
+            query = query.where(position > after)
+    return EventPage(query.limit(page_size + 1), page_size)
@@ -7,6 +7,7 @@ from flask import (
     flash,
     send_file,
     current_app,
+    jsonify,
 )
 from flask_login import login_required, current_user
 import os
@@ -21,17 +22,24 @@ from ..models import (
     EmailSettings,
     EventRegistration,
     EventWaitlist,
+    adjust_active_count,
+    consume_pass_use,
+    return_pass_use,
 )
 from ..forms import PassForm, UserForm, EmailSettingsForm, RestoreForm
-from ..utils import send_email, send_event_email
-from .event_routes import _promote_waitlist
+from ..outbox import queue_email, queue_event_email
+from ..settings_cache import invalidate_email_settings
+from ..utils import resolve_picked_user, search_users
+from ..sqlite_tuning import checkpoint
+from ..waitlist import queue_promotion
 from ..email_templates import (
     pass_created_email,
     pass_deleted_email,
     pass_used_email,
     pass_usage_reverted_email,
     registration_email,
-    base_email_template,
+    render_email,
+    user_deleted_email,
 )
 from datetime import date, datetime
 
@@ -44,26 +52,27 @@ def blacklist():
     if current_user.role != 'admin':
         return redirect(url_for('user.dashboard'))
 
-    users = User.query.order_by(User.username).all()
-    blacklisted_users = [user for user in users if user.is_blacklisted]
-    available_users = [
-        user for user in users if not user.is_blacklisted and user.role != 'admin'
-    ]
-
-    return render_template(
-        'blacklist.html',
-        blacklisted_users=blacklisted_users,
-        available_users=available_users,
+    # Only the blacklist itself is listed; users to add are picked with the
+    # typeahead, so the page does not grow with the number of users.
+    blacklisted_users = (
+        User.query.filter_by(is_blacklisted=True).order_by(User.username).all()
     )
 
+    return render_template('blacklist.html', blacklisted_users=blacklisted_users)
+
 
-@admin_bp.route('/blacklist/add/<int:user_id>', methods=['POST'])
+@admin_bp.route('/blacklist/add', methods=['POST'])
 @login_required
-def add_to_blacklist(user_id):
+def add_to_blacklist():
     if current_user.role != 'admin':
         return redirect(url_for('user.dashboard'))
 
-    user = User.query.get_or_404(user_id)
+    user = resolve_picked_user(
+        request.form.get('user_id', type=int), request.form.get('user_search')
+    )
+    if not user:
+        flash('Nem található ilyen felhasználó.', 'danger')
+        return redirect(url_for('admin.blacklist'))
     if user.role == 'admin':
         flash('Admin felhasználó nem helyezhető feketelistára.', 'warning')
         return redirect(url_for('admin.blacklist'))
@@ -102,10 +111,12 @@ def create_pass():
         return redirect(url_for('user.dashboard'))
 
     form = PassForm()
-    users = User.query.all()
-    form.user_id.choices = [(u.id, u.username) for u in users]
 
     if form.validate_on_submit():
+        user = resolve_picked_user(form.user_id.data, form.user_search.data)
+        if not user:
+            flash("Nem található ilyen felhasználó.", "danger")
+            return render_template('create_pass.html', form=form)
         new_pass = Pass(
             type=form.type.data,
             start_date=form.start_date.data,
@@ -113,16 +124,16 @@ def create_pass():
             total_uses=form.total_uses.data,
             used=0,
             comment=form.comment.data,
-            user_id=form.user_id.data
+            user_id=user.id
         )
         db.session.add(new_pass)
-        db.session.commit()
-        send_event_email(
+        queue_event_email(
             'pass_created',
             "Új bérlet",
             pass_created_email(new_pass),
-            new_pass.user.email
+            user.email
         )
+        db.session.commit()
         flash("Bérlet sikeresen létrehozva.", "success")
         return redirect(url_for('user.dashboard'))
 
@@ -170,14 +181,14 @@ def approve_pass_request(request_id):
     pass_request.processed_at = datetime.utcnow()
     pass_request.pass_id = new_pass.id
 
-    db.session.commit()
-
-    send_event_email(
+    queue_event_email(
         'pass_created',
         'Új bérlet',
         pass_created_email(new_pass),
         pass_request.user.email,
+        dedupe_key=f'pass_request_approved:{pass_request.id}',
     )
+    db.session.commit()
 
     flash('Bérlet aktiválva és a felhasználó értesítve.', 'success')
     return redirect(url_for('admin.pass_requests'))
@@ -210,21 +221,25 @@ def extend_pass(pass_id):
 
     p = Pass.query.get_or_404(pass_id)
     form = PassForm(obj=p)
-    users = User.query.all()
-    form.user_id.choices = [(u.id, u.username) for u in users]
+    if request.method == 'GET':
+        form.user_search.data = p.user.username
     if form.validate_on_submit():
+        user = resolve_picked_user(form.user_id.data, form.user_search.data)
+        if not user:
+            flash("Nem található ilyen felhasználó.", "danger")
+            return render_template('extend_pass.html', form=form, pass_id=pass_id, p=p)
         p.type = form.type.data
         p.start_date = form.start_date.data
         p.end_date = form.end_date.data
         p.total_uses = form.total_uses.data
         p.comment = form.comment.data
-        p.user_id = form.user_id.data
-        db.session.commit()
-        send_email(
+        p.user_id = user.id
+        queue_email(
             "Bérlet hosszabbítva",
-            pass_created_email(p),
-            p.user.email,
+            render_email(pass_created_email(p)),
+            user.email,
         )
+        db.session.commit()
         flash("Bérlet módosítva.", "success")
         return redirect(url_for('admin.verify_pass', pass_id=p.id))
 
@@ -247,13 +262,13 @@ def delete_pass(pass_id):
     used = selected_pass.used
 
     db.session.delete(selected_pass)
-    db.session.commit()
-    send_event_email(
+    queue_event_email(
         'pass_deleted',
         "Bérlet törölve",
         pass_deleted_email(user_name, pass_type, start_date, end_date, used),
         user_email,
     )
+    db.session.commit()
     flash("Bérlet törölve.", "success")
     return redirect(url_for('user.dashboard'))
 
@@ -276,17 +291,14 @@ def use_pass(pass_id):
         return redirect(url_for('user.dashboard'))
 
     p = Pass.query.get_or_404(pass_id)
-    if p.used < p.total_uses and p.end_date >= date.today():
-        p.used += 1
-        usage = PassUsage(pass_id=pass_id)
-        db.session.add(usage)
-        db.session.commit()
-        send_event_email(
+    if consume_pass_use(pass_id):
+        queue_event_email(
             'pass_used',
             "Bérlet használat",
             pass_used_email(p),
             p.user.email,
         )
+        db.session.commit()
         flash("Alkalom hozzáadva.", "success")
     else:
         flash("A bérlet nem használható.", "danger")
@@ -300,22 +312,20 @@ def undo_use(pass_id):
         return redirect(url_for('user.dashboard'))
 
     p = Pass.query.get_or_404(pass_id)
-    if p.used > 0:
-        p.used -= 1
-        last_usage = (
-            PassUsage.query.filter_by(pass_id=pass_id)
-            .order_by(PassUsage.used_on.desc())
-            .first()
-        )
-        if last_usage:
-            db.session.delete(last_usage)
-        db.session.commit()
-        send_event_email(
+    last_usage_id = db.session.scalar(
+        db.select(PassUsage.id)
+        .where(PassUsage.pass_id == pass_id)
+        .order_by(PassUsage.used_on.desc())
+        .limit(1)
+    )
+    if return_pass_use(pass_id, last_usage_id):
+        queue_event_email(
             'pass_used',
             "Bérlet használat visszavonva",
             pass_usage_reverted_email(p),
             p.user.email,
         )
+        db.session.commit()
         flash("Felhasználás visszavonva.", "success")
     return redirect(url_for('admin.verify_pass', pass_id=pass_id))
 
@@ -329,6 +339,20 @@ def users():
     return render_template('users.html', users=users)
 
 
+@admin_bp.route('/users/search')
+@login_required
+def user_search():
+    """Return users matching a username or email prefix for the pickers."""
+    if current_user.role != 'admin':
+        return jsonify([]), 403
+
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    users = search_users(request.args.get('q', ''), limit)
+    return jsonify(
+        [{'id': u.id, 'username': u.username, 'email': u.email} for u in users]
+    )
+
+
 @admin_bp.route('/create_user', methods=['GET', 'POST'])
 @login_required
 def create_user():
@@ -349,13 +373,13 @@ def create_user():
         user = User(username=form.username.data, email=form.email.data, role=form.role.data)
         user.set_password(form.password.data)
         db.session.add(user)
-        db.session.commit()
-        send_event_email(
+        queue_event_email(
             'user_created',
             "Felhasználó létrehozva",
             registration_email(user.username, form.password.data),
             user.email,
         )
+        db.session.commit()
         flash("Felhasználó létrehozva.", "success")
         return redirect(url_for('admin.users'))
 
@@ -414,14 +438,14 @@ def delete_user(user_id):
     registrations = EventRegistration.query.filter_by(user_id=user.id).all()
     affected_event_ids = {registration.event_id for registration in registrations}
     for registration in registrations:
-        if registration.pass_usage_id:
-            usage = PassUsage.query.get(registration.pass_usage_id)
-            if usage:
-                db.session.delete(usage)
+        usage_id = registration.pass_usage_id
+        registration.pass_usage_id = None
         if registration.registration_type == 'pass' and registration.pass_id:
-            related_pass = Pass.query.get(registration.pass_id)
-            if related_pass and related_pass.used > 0:
-                related_pass.used -= 1
+            return_pass_use(registration.pass_id, usage_id)
+        elif usage_id:
+            db.session.execute(db.delete(PassUsage).where(PassUsage.id == usage_id))
+        if registration.status == 'active':
+            adjust_active_count(registration.event_id, -1)
         db.session.delete(registration)
 
     # Remove the user from all event waitlists.
@@ -435,16 +459,16 @@ def delete_user(user_id):
         db.session.delete(p)
 
     db.session.delete(user)
-    db.session.commit()
-
-    for event_id in affected_event_ids:
-        _promote_waitlist(event_id)
-    send_event_email(
+    queue_event_email(
         'user_deleted',
         "Felhasználó törölve",
-        base_email_template("Felhasználó törölve", f"{username} törölve."),
+        user_deleted_email(username),
         user_email,
     )
+    db.session.commit()
+
+    for event_id in affected_event_ids:
+        queue_promotion(event_id)
     flash("Felhasználó törölve.", "success")
     return redirect(url_for('admin.users'))
 
@@ -460,11 +484,19 @@ def email_settings():
         settings = EmailSettings()
         db.session.add(settings)
         db.session.commit()
+        invalidate_email_settings()
 
     form = EmailSettingsForm(obj=settings)
     if form.validate_on_submit():
         form.populate_obj(settings)
+        # Bump in SQL, so two concurrent saves never write the same version.
+        db.session.execute(
+            db.update(EmailSettings)
+            .where(EmailSettings.id == settings.id)
+            .values(version=EmailSettings.version + 1)
+        )
         db.session.commit()
+        invalidate_email_settings()
         flash("Beállítások mentve.", "success")
         return redirect(url_for('user.dashboard'))
 
@@ -484,6 +516,9 @@ def backup():
         flash('Nincs adatbázis a mentéshez.', 'danger')
         return redirect(url_for('admin.email_settings'))
 
+    # In WAL mode recent commits may still live in ``passes.db-wal``; fold
+    # them into the main file so the download is complete.
+    checkpoint(db.engine)
     return send_file(db_file, as_attachment=True, download_name='passes_backup.db')
 
 
@@ -503,7 +538,13 @@ def restore():
             db_file = os.path.join(instance_dir, 'passes.db')
             db.session.remove()
             db.engine.dispose()
+            # A leftover write-ahead log belongs to the old database and would
+            # be replayed on top of the restored file.
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(db_file + suffix):
+                    os.remove(db_file + suffix)
             uploaded.save(db_file)
+            invalidate_email_settings()
             flash('Adatbázis visszaállítva.', 'success')
             return redirect(url_for('admin.email_settings'))
         flash('Nem megfelelő fájl.', 'danger')
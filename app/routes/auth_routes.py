@@ -4,8 +4,13 @@ from werkzeug.security import check_password_hash
 
 from ..models import User, PendingUser, db
 from ..forms import LoginForm, ForgotPasswordForm, RegistrationForm
-from ..utils import send_email
-from ..email_templates import forgot_password_email, registration_confirmation_email
+from ..outbox import queue_email
+from ..utils import email_credentials
+from ..email_templates import (
+    forgot_password_email,
+    registration_confirmation_email,
+    render_email,
+)
 import secrets
 
 auth_bp = Blueprint('auth', __name__)
@@ -56,16 +61,23 @@ def register():
         )
         pending_user.set_password(form.password.data)
         db.session.add(pending_user)
-        db.session.commit()
 
         confirmation_link = url_for('auth.verify_registration', token=token, _external=True)
-        if not send_email(
+        queue_email(
             'Regisztráció megerősítése',
-            registration_confirmation_email(form.username.data, confirmation_link),
+            render_email(
+                registration_confirmation_email(form.username.data, confirmation_link)
+            ),
             form.email.data,
-        ):
+            dedupe_key=f'registration:{token}',
+        )
+        db.session.commit()
+
+        # The outbox delivers the email later; without credentials it never
+        # could, so offer the link right away like before.
+        if not all(email_credentials()):
             current_app.logger.warning(
-                'Nem sikerült regisztrációs megerősítő e-mailt küldeni erre a címre: %s',
+                'Nincs beállítva e-mail küldés, a megerősítő e-mail nem megy ki erre a címre: %s',
                 form.email.data,
             )
             flash(
@@ -94,12 +106,12 @@ def forgot_password():
             if not password:
                 password = secrets.token_urlsafe(8)
                 user.set_password(password)
-                db.session.commit()
-            send_email(
+            queue_email(
                 "Elfelejtett jelszó",
-                forgot_password_email(user.username, password),
+                render_email(forgot_password_email(user.username, password)),
                 user.email,
             )
+            db.session.commit()
             flash('Jelszó elküldve az email címre.', 'success')
             return redirect(url_for('auth.login'))
         else:
@@ -1,5 +1,5 @@
 import os
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta
 
 from flask import (
     Blueprint,
@@ -9,21 +9,34 @@ from flask import (
     request,
     flash,
     current_app,
+    abort,
+    g,
+    has_request_context,
 )
 from flask_login import login_required, current_user
+from sqlalchemy.orm import joinedload, selectinload
 from werkzeug.utils import secure_filename
 
 from ..models import (
     Event,
     EventRegistration,
     EventWaitlist,
-    User,
     Pass,
-    PassUsage,
+    adjust_active_count,
+    available_passes,
+    consume_pass_use,
     db,
+    reminder_due_time,
+    reschedule_reminders,
+    reserve_seat,
+    return_pass_use,
 )
 from ..forms import EventForm
-from ..utils import send_email, send_event_email
+from ..read_models import event_listings, event_page
+from ..outbox import queue_email, queue_event_email
+from ..transactions import run_with_retry
+from ..waitlist import queue_promotion
+from ..utils import resolve_picked_user
 from ..email_templates import (
     event_signup_user_email,
     event_signup_admin_email,
@@ -31,6 +44,7 @@ from ..email_templates import (
     event_unregister_admin_email,
     event_waitlist_join_email,
     event_waitlist_removed_email,
+    render_email,
 )
 
 
@@ -38,31 +52,85 @@ event_bp = Blueprint('events', __name__)
 
 
 def _get_available_pass(user, preferred_pass_id=None):
-    """Return the user's first valid pass with remaining uses."""
-    today = date.today()
-    passes = Pass.query.filter_by(user_id=user.id).all()
-    valid = [
-        p
-        for p in passes
-        if p.start_date <= today <= p.end_date and p.used < p.total_uses
-    ]
-    if preferred_pass_id:
-        for p in valid:
-            if p.id == preferred_pass_id:
-                return p
-    if valid:
-        valid.sort(key=lambda p: (p.end_date, p.id))
-        return valid[0]
-    return None
-
-
-def _handle_pass_usage(selected_pass):
-    """Reserve one usage on the given pass and return the usage ID."""
-    selected_pass.used += 1
-    usage = PassUsage(pass_id=selected_pass.id)
-    db.session.add(usage)
-    db.session.flush()
-    return usage.id
+    """Return the user's first valid pass with remaining uses.
+
+    ``preferred_pass_id`` wins when it is valid. Within a request the
+    result is memoized on ``g``, so the event list and a signup in the same
+    request query the passes only once; the pass is still consumed with the
+    guarded ``consume_pass_use``, which drops the user's memoized passes.
+    Background runs, which keep one app context for many promotions, always
+    query.
+    """
+    memo = g.setdefault('available_passes', {}) if has_request_context() else {}
+    key = (user.id, preferred_pass_id)
+    if key not in memo:
+        query = available_passes(user.id)
+        selected = None
+        if preferred_pass_id:
+            selected = db.session.scalar(
+                query.where(Pass.id == preferred_pass_id).limit(1)
+            )
+        memo[key] = selected or db.session.scalar(query.limit(1))
+    return memo[key]
+
+
+def _forget_available_passes(user_id: int) -> None:
+    """Drop the memoized passes of ``user_id`` after one of them changed."""
+    memo = g.get('available_passes')
+    if memo:
+        for key in [key for key in memo if key[0] == user_id]:
+            del memo[key]
+
+
+class _SignupRejected(Exception):
+    """Raised inside a signup transaction when the seat or the pass is gone.
+
+    ``reason`` is ``'full'`` or ``'pass'``.
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def _add_registration(event, user, selected_pass=None, flush=True, **fields):
+    """Add an active registration on a seat the caller has already claimed.
+
+    The pass use is taken with the guarded ``consume_pass_use``;
+    ``_SignupRejected('pass')`` is raised, before anything is written, when
+    it is gone. The registration is flushed, giving it the ID the
+    notification dedupe keys use, unless the caller flushes a whole batch.
+    """
+    registration = EventRegistration(
+        event_id=event.id,
+        user_id=user.id,
+        registration_type='pass' if selected_pass else 'single',
+        reminder_due_at=reminder_due_time(event.start_time),
+        **fields,
+    )
+    if selected_pass:
+        usage = consume_pass_use(selected_pass.id)
+        _forget_available_passes(user.id)
+        if usage is None:
+            raise _SignupRejected('pass')
+        registration.pass_id = selected_pass.id
+        registration.pass_usage_id = usage.id
+    db.session.add(registration)
+    if flush:
+        db.session.flush()
+    return registration
+
+
+def _create_registration(event, user, selected_pass=None, **fields):
+    """Claim a seat (and a pass use) and add an active registration.
+
+    The seat is taken with ``reserve_seat`` before the registration is
+    written, so capacity and pass limits hold under concurrent requests;
+    ``_SignupRejected`` is raised when the seat or the pass is gone.
+    """
+    if not reserve_seat(event.id):
+        raise _SignupRejected('full')
+    return _add_registration(event, user, selected_pass, **fields)
 
 
 def _uploads_dir() -> str:
@@ -86,7 +154,11 @@ def _save_event_image(file_storage):
 
 
 def _cancel_registration(registration, force_late=None):
-    """Cancel a registration and handle pass adjustments."""
+    """Cancel a registration and handle pass adjustments.
+
+    The caller commits, so notifications can be queued in the same
+    transaction.
+    """
     event = registration.event
     now = datetime.now()
     late_cancel = (
@@ -95,127 +167,152 @@ def _cancel_registration(registration, force_late=None):
         else (event.start_time - now <= timedelta(minutes=1))
     )
     if registration.registration_type == 'pass' and registration.pass_id:
-        selected_pass = Pass.query.get(registration.pass_id)
         if not late_cancel:
-            if selected_pass and selected_pass.used > 0:
-                selected_pass.used -= 1
-            if registration.pass_usage_id:
-                usage = PassUsage.query.get(registration.pass_usage_id)
-                if usage:
-                    db.session.delete(usage)
+            usage_id = registration.pass_usage_id
             registration.pass_usage_id = None
+            return_pass_use(registration.pass_id, usage_id)
+            _forget_available_passes(registration.user_id)
         else:
             registration.is_late_cancel = True
+    if registration.status == 'active':
+        adjust_active_count(registration.event_id, -1)
     registration.status = 'late_cancelled' if late_cancel else 'cancelled'
     registration.cancelled_at = datetime.utcnow()
-    db.session.commit()
+    registration.reminder_due_at = None
     return late_cancel
 
 
-def _promote_waitlist_entry(entry, event=None, remove_on_fail=False):
-    """Promote a single waitlist entry to an active registration."""
-    event = event or entry.event
-    if not event or event.status != 'upcoming' or event.spots_left <= 0:
-        return False
-
-    if EventRegistration.query.filter_by(
-        event_id=event.id, user_id=entry.user_id, status='active'
-    ).first():
-        if remove_on_fail:
-            db.session.delete(entry)
-            db.session.commit()
-        return False
-
-    user = entry.user
-    if user.is_blacklisted:
-        if remove_on_fail:
-            db.session.delete(entry)
-            db.session.commit()
-        return False
-    selected_pass = None
-    registration_type = entry.registration_type
-    if event.is_final_event:
-        registration_type = 'single'
-    elif registration_type == 'pass':
-        selected_pass = _get_available_pass(user, entry.pass_id)
-        if not selected_pass:
-            if remove_on_fail:
-                db.session.delete(entry)
-                db.session.commit()
-            return False
+def _waitlist_ahead(event_id: int, user_id: int) -> bool:
+    """Whether someone waits for ``event_id`` before ``user_id``.
 
-    registration = EventRegistration(
-        event_id=event.id,
-        user_id=user.id,
-        registration_type=registration_type,
-        waitlist_promoted=True,
+    Seats freed by a cancellation stay open until the waitlist worker fills
+    them; a user who is not at the head of the waitlist must not take them.
+    """
+    own = (
+        db.select(EventWaitlist.created_at)
+        .where(EventWaitlist.event_id == event_id, EventWaitlist.user_id == user_id)
+        .scalar_subquery()
     )
-    if selected_pass:
-        registration.pass_id = selected_pass.id
-        registration.pass_usage_id = _handle_pass_usage(selected_pass)
-    db.session.add(registration)
-    db.session.delete(entry)
-    db.session.commit()
-
-    send_event_email(
-        'event_signup_user',
-        'Esemény jelentkezés',
-        event_signup_user_email(user.username, event, from_waitlist=True),
-        user.email,
+    return db.session.scalar(
+        db.select(
+            db.select(EventWaitlist.id)
+            .where(
+                EventWaitlist.event_id == event_id,
+                EventWaitlist.user_id != user_id,
+                db.or_(own.is_(None), EventWaitlist.created_at < own),
+            )
+            .exists()
+        )
     )
-    return True
 
 
-def _promote_waitlist(event_id: int):
-    """Move the first waitlisted users into the event if space allows."""
-    event = Event.query.get(event_id)
-    if not event:
-        return
+def _promote_waitlist(event_id: int) -> int:
+    """Fill the free seats of an event from the head of its waitlist.
+
+    Everything happens in one transaction: the waitlist is read once in
+    arrival order together with its users, the seats are claimed with a
+    single ``reserve_seat`` and the signup emails are queued in the outbox.
+    Entries that can no longer be promoted (already registered, blacklisted
+    or without a usable pass) are dropped. Returns the number of promoted
+    users.
+    """
+
+    def _promote():
+        event = db.session.get(Event, event_id)
+        if not event or event.status != 'upcoming' or event.spots_left <= 0:
+            return 0
+        entries = (
+            EventWaitlist.query.filter_by(event_id=event_id)
+            .options(joinedload(EventWaitlist.user))
+            .order_by(EventWaitlist.created_at, EventWaitlist.id)
+            .all()
+        )
+        if not entries:
+            return 0
+
+        # Claim the seats up front. The first write takes the database lock,
+        # so if another request took seats since ``event`` was read, the
+        # refreshed count is final.
+        seats = min(event.spots_left, len(entries))
+        while not reserve_seat(event_id, seats):
+            db.session.refresh(event)
+            seats = min(event.spots_left, len(entries))
+            if seats <= 0:
+                return 0
+
+        registered = set(
+            db.session.scalars(
+                db.select(EventRegistration.user_id).where(
+                    EventRegistration.event_id == event_id,
+                    EventRegistration.status == 'active',
+                )
+            )
+        )
+        promoted = []
+        for entry in entries:
+            if len(promoted) == seats:
+                break
+            user = entry.user
+            db.session.delete(entry)
+            if user.id in registered or user.is_blacklisted:
+                continue
+            selected_pass = None
+            if not event.is_final_event and entry.registration_type == 'pass':
+                selected_pass = _get_available_pass(user, entry.pass_id)
+                if not selected_pass:
+                    continue
+            try:
+                registration = _add_registration(
+                    event, user, selected_pass, flush=False, waitlist_promoted=True
+                )
+            except _SignupRejected:
+                continue
+            promoted.append(registration)
+        # One flush inserts every registration and gives them their IDs.
+        db.session.flush()
+
+        if len(promoted) < seats:
+            adjust_active_count(event_id, len(promoted) - seats)
+        for registration in promoted:
+            user = registration.user
+            queue_event_email(
+                'event_signup_user',
+                'Esemény jelentkezés',
+                event_signup_user_email(user.username, event, from_waitlist=True),
+                user.email,
+                dedupe_key=f'event_signup_user:{registration.id}',
+            )
+        return len(promoted)
+
+    return run_with_retry(_promote)
 
-    if event.status != 'upcoming':
-        return
 
-    while event.spots_left > 0:
-        entry = (
-            EventWaitlist.query.filter_by(event_id=event.id)
-            .order_by(EventWaitlist.created_at)
-            .first()
-        )
-        if not entry:
-            break
-        _promote_waitlist_entry(entry, event, remove_on_fail=True)
-        event = Event.query.get(event.id)
+def _requested_event_page(archive):
+    return event_page(
+        archive=archive,
+        cursor=request.args.get('after'),
+        page_size=current_app.config['EVENT_LIST_PAGE_SIZE'],
+        recent_days=current_app.config['EVENT_LIST_RECENT_DAYS'],
+    )
 
 
 @event_bp.route('/events')
 @login_required
 def events():
-    events = Event.query.order_by(Event.start_time).all()
-    active_registrations = {
-        reg.event_id: reg
-        for reg in EventRegistration.query.filter_by(
-            user_id=current_user.id, status='active'
-        )
-    }
-    latest_registrations = {}
-    for reg in (
-        EventRegistration.query.filter_by(user_id=current_user.id)
-        .order_by(EventRegistration.created_at.desc())
-        .all()
-    ):
-        if reg.event_id not in latest_registrations:
-            latest_registrations[reg.event_id] = reg
-    waitlist_map = {
-        entry.event_id: entry
-        for entry in EventWaitlist.query.filter_by(user_id=current_user.id).all()
-    }
+    archive = request.args.get('archive', type=int) == 1
+    page = _requested_event_page(archive)
+    listings, next_cursor = page.split(
+        event_listings(current_user.id, page.events_query),
+        key=lambda listing: listing.event,
+    )
+    waitlist_total = EventWaitlist.query.filter_by(user_id=current_user.id).count()
     has_active_pass = _get_available_pass(current_user) is not None
     return render_template(
         'events.html',
-        events=events,
-        active_registrations=active_registrations,
-        latest_registrations=latest_registrations,
-        waitlist_map=waitlist_map,
+        listings=listings,
+        archive=archive,
+        next_cursor=next_cursor,
+        waitlist_total=waitlist_total,
         has_active_pass=has_active_pass,
         user_blacklisted=current_user.is_blacklisted,
     )
@@ -239,7 +336,7 @@ def signup(event_id):
         flash('Már jelentkeztél erre az eseményre.', 'warning')
         return redirect(url_for('events.events'))
 
-    if event.spots_left <= 0:
+    if event.spots_left <= 0 or _waitlist_ahead(event_id, current_user.id):
         flash('Az esemény teltházas, csatlakozz a várólistához.', 'warning')
         return redirect(url_for('events.events'))
 
@@ -255,29 +352,29 @@ def signup(event_id):
             flash('Nincs elérhető bérleted a jelentkezéshez.', 'danger')
             return redirect(url_for('events.events'))
 
-    waitlist_entry = EventWaitlist.query.filter_by(
-        event_id=event_id, user_id=current_user.id
-    ).first()
-    if waitlist_entry:
-        db.session.delete(waitlist_entry)
-
-    registration = EventRegistration(
-        event_id=event_id,
-        user_id=current_user.id,
-        registration_type='pass' if selected_pass else 'single',
-    )
-    if selected_pass:
-        registration.pass_id = selected_pass.id
-        registration.pass_usage_id = _handle_pass_usage(selected_pass)
-    db.session.add(registration)
-    db.session.commit()
+    def _signup():
+        registration = _create_registration(event, current_user, selected_pass)
+        waitlist_entry = EventWaitlist.query.filter_by(
+            event_id=event_id, user_id=current_user.id
+        ).first()
+        if waitlist_entry:
+            db.session.delete(waitlist_entry)
+        queue_event_email(
+            'event_signup_user',
+            'Esemény jelentkezés',
+            event_signup_user_email(current_user.username, event),
+            current_user.email,
+            dedupe_key=f'event_signup_user:{registration.id}',
+        )
 
-    send_event_email(
-        'event_signup_user',
-        'Esemény jelentkezés',
-        event_signup_user_email(current_user.username, event),
-        current_user.email,
-    )
+    try:
+        run_with_retry(_signup)
+    except _SignupRejected as exc:
+        if exc.reason == 'full':
+            flash('Az esemény teltházas, csatlakozz a várólistához.', 'warning')
+        else:
+            flash('Nincs elérhető bérleted a jelentkezéshez.', 'danger')
+        return redirect(url_for('events.events'))
     flash('Jelentkezés sikeres.', 'success')
     return redirect(url_for('events.events'))
 
@@ -310,7 +407,7 @@ def unregister(event_id):
         late_cancel = _cancel_registration(registration)
         used_pass = registration.registration_type == 'pass'
         deduction_kept = used_pass and (late_cancel or registration.pass_usage_id is not None)
-        send_event_email(
+        queue_event_email(
             'event_unregister_user',
             'Esemény leiratkozás',
             event_unregister_user_email(
@@ -321,12 +418,14 @@ def unregister(event_id):
                 deduction_kept=deduction_kept,
             ),
             current_user.email,
+            dedupe_key=f'event_unregister_user:{registration.id}',
         )
+        db.session.commit()
         if late_cancel and registration.registration_type == 'pass':
             flash('1 percen belül mondtad le, az alkalom levonva marad.', 'warning')
         else:
             flash('Jelentkezés törölve.', 'success')
-        _promote_waitlist(event_id)
+        queue_promotion(event_id)
     else:
         db.session.delete(waitlist_entry)
         db.session.commit()
@@ -354,7 +453,7 @@ def join_waitlist(event_id):
         flash('Már jelentkeztél erre az eseményre.', 'warning')
         return redirect(url_for('events.events'))
 
-    if event.spots_left > 0:
+    if event.spots_left > 0 and not _waitlist_ahead(event_id, current_user.id):
         flash('Még van szabad hely, jelentkezz közvetlenül.', 'info')
         return redirect(url_for('events.events'))
 
@@ -384,12 +483,12 @@ def join_waitlist(event_id):
 
     waitlist_entry = EventWaitlist(**entry_kwargs)
     db.session.add(waitlist_entry)
-    db.session.commit()
-    send_email(
+    queue_email(
         'Várólista jelentkezés',
-        event_waitlist_join_email(current_user.username, event),
+        render_email(event_waitlist_join_email(current_user.username, event)),
         current_user.email,
     )
+    db.session.commit()
     flash('Feliratkoztál a várólistára.', 'success')
     return redirect(url_for('events.events'))
 
@@ -411,9 +510,22 @@ def leave_waitlist(event_id):
 def admin_events():
     if current_user.role != 'admin':
         return redirect(url_for('events.events'))
-    events = Event.query.order_by(Event.start_time).all()
-    users = User.query.all()
-    return render_template('admin_events.html', events=events, users=users)
+    archive = request.args.get('archive', type=int) == 1
+    page = _requested_event_page(archive)
+    # The template lists every registration and waitlist entry with the
+    # user's name, so load them up front: one query per relationship instead
+    # of several lazy loads per event.
+    query = page.events_query.options(
+        selectinload(Event.registrations).joinedload(EventRegistration.user),
+        selectinload(Event.waitlist_entries).joinedload(EventWaitlist.user),
+    )
+    events, next_cursor = page.split(db.session.scalars(query).all())
+    return render_template(
+        'admin_events.html',
+        events=events,
+        archive=archive,
+        next_cursor=next_cursor,
+    )
 
 
 @event_bp.route('/admin/events/create', methods=['GET', 'POST'])
@@ -462,8 +574,10 @@ def edit_event(event_id):
 
     if form.validate_on_submit():
         event.name = form.name.data
+        previous_start = event.start_time
         event.start_time = datetime.combine(form.date.data, form.start_time.data)
         event.end_time = datetime.combine(form.date.data, form.end_time.data)
+        capacity_raised = form.capacity.data > event.capacity
         event.capacity = form.capacity.data
         event.color = form.color.data
         event.price = form.price.data if form.price.data is not None else None
@@ -471,7 +585,11 @@ def edit_event(event_id):
         image_path = _save_event_image(form.image.data)
         if image_path:
             event.image_path = image_path
+        if event.start_time != previous_start:
+            reschedule_reminders(event)
         db.session.commit()
+        if capacity_raised:
+            queue_promotion(event_id)
         flash('Esemény frissítve.', 'success')
         return redirect(url_for('events.admin_events', _anchor=f'event-{event_id}'))
 
@@ -499,9 +617,13 @@ def toggle_final_event(event_id):
 def add_user(event_id):
     if current_user.role != 'admin':
         return redirect(url_for('events.events'))
-    user_id = request.form.get('user_id', type=int)
     registration_type = request.form.get('registration_type', 'single')
-    user = User.query.get_or_404(user_id)
+    user = resolve_picked_user(
+        request.form.get('user_id', type=int), request.form.get('user_search')
+    )
+    if not user:
+        abort(404)
+    user_id = user.id
     event = Event.query.get_or_404(event_id)
 
     if user.is_blacklisted:
@@ -541,35 +663,35 @@ def add_user(event_id):
                 entry_kwargs['pass_id'] = selected_pass.id
             waitlist_entry = EventWaitlist(**entry_kwargs)
             db.session.add(waitlist_entry)
-            db.session.commit()
-            send_email(
+            queue_email(
                 'Várólista jelentkezés',
-                event_waitlist_join_email(user.username, event),
+                render_email(event_waitlist_join_email(user.username, event)),
                 user.email,
             )
+            db.session.commit()
             flash('Az esemény teltházas, a felhasználó a várólistára került.', 'info')
         return redirect(url_for('events.admin_events', _anchor=f'event-{event_id}'))
 
-    if waitlist_entry:
-        db.session.delete(waitlist_entry)
-
-    registration = EventRegistration(
-        event_id=event_id,
-        user_id=user_id,
-        registration_type='pass' if selected_pass else 'single',
-    )
-    if selected_pass:
-        registration.pass_id = selected_pass.id
-        registration.pass_usage_id = _handle_pass_usage(selected_pass)
-    db.session.add(registration)
-    db.session.commit()
+    def _add():
+        registration = _create_registration(event, user, selected_pass)
+        if waitlist_entry:
+            db.session.delete(waitlist_entry)
+        queue_event_email(
+            'event_signup_admin',
+            'Esemény jelentkezés',
+            event_signup_admin_email(user.username, event),
+            user.email,
+            dedupe_key=f'event_signup_admin:{registration.id}',
+        )
 
-    send_event_email(
-        'event_signup_admin',
-        'Esemény jelentkezés',
-        event_signup_admin_email(user.username, event),
-        user.email,
-    )
+    try:
+        run_with_retry(_add)
+    except _SignupRejected as exc:
+        if exc.reason == 'full':
+            flash('Az esemény időközben megtelt.', 'warning')
+        else:
+            flash('A felhasználónak nincs aktív bérlete.', 'danger')
+        return redirect(url_for('events.admin_events', _anchor=f'event-{event_id}'))
     flash('Felhasználó hozzáadva.', 'success')
     return redirect(url_for('events.admin_events', _anchor=f'event-{event_id}'))
 
@@ -585,14 +707,16 @@ def remove_user(event_id, user_id):
     _cancel_registration(registration, force_late=False)
     event = registration.event
     user = registration.user
-    send_event_email(
+    queue_event_email(
         'event_unregister_admin',
         'Esemény leiratkozás',
         event_unregister_admin_email(user.username, event),
         user.email,
+        dedupe_key=f'event_unregister_admin:{registration.id}',
     )
+    db.session.commit()
     flash('Felhasználó eltávolítva.', 'success')
-    _promote_waitlist(event_id)
+    queue_promotion(event_id)
     return redirect(url_for('events.admin_events', _anchor=f'event-{event_id}'))
 
 
@@ -632,12 +756,12 @@ def remove_waitlist_entry(event_id, entry_id):
     event = entry.event
     user = entry.user
     db.session.delete(entry)
-    db.session.commit()
-    send_email(
+    queue_email(
         'Várólista eltávolítás',
-        event_waitlist_removed_email(user.username, event),
+        render_email(event_waitlist_removed_email(user.username, event)),
         user.email,
     )
+    db.session.commit()
     flash('Várólista jelentkezés törölve.', 'success')
     return redirect(url_for('events.admin_events', _anchor=f'event-{event_id}'))
 
@@ -3,9 +3,9 @@ from flask_login import login_required, current_user
 
 from .. import db
 from ..forms import PurchasePassForm
-from ..models import Pass, PassRequest, User
-from ..email_templates import pass_request_admin_email
-from ..utils import send_email
+from ..models import Pass, PassRequest
+from ..email_templates import pass_request_admin_email, render_email
+from ..outbox import queue_admin_email
 
 
 user_bp = Blueprint('user', __name__)
@@ -63,12 +63,14 @@ def purchase_pass():
             requested_uses=int(form.pass_type.data),
         )
         db.session.add(pass_request)
-        db.session.commit()
+        db.session.flush()
 
-        admins = User.query.filter_by(role='admin').all()
-        html = pass_request_admin_email(current_user, pass_request)
-        for admin in admins:
-            send_email('Új bérlet igénylés', html, admin.email)
+        queue_admin_email(
+            'Új bérlet igénylés',
+            render_email(pass_request_admin_email(current_user, pass_request)),
+            dedupe_key=f'pass_request_admin:{pass_request.id}',
+        )
+        db.session.commit()
 
         flash('Bérlet igénylésed rögzítettük.', 'success')
         return redirect(url_for('user.dashboard'))
@@ -0,0 +1,155 @@
+"""In-process scheduler for the notification tasks.
+
+Replaces the cron-spawned ``send_event_notifications.py`` runs, which paid
+a full ``create_app()`` for every invocation. An APScheduler
+``BackgroundScheduler`` in the already running app calls
+``notification_tasks.run_task`` on the intervals in the
+``SCHEDULER_*_MINUTES`` settings, plus the waitlist sweep of
+``waitlist.promote_all``.
+
+Jobs live in the ``apscheduler_jobs`` table of the app database, so their
+next run times survive restarts. Runs missed while no process was up are
+coalesced into a single catch-up run. Only the process holding the
+``<database>.scheduler.lock`` file schedules jobs; the other workers retry
+for the lock in the background and take over if the leader exits.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from . import db
+from .locking import database_lock_path, try_lock
+
+
+# Job ID -> (``notification_tasks.TASKS`` key, interval config key).
+JOBS = {
+    'event_reminders': ('reminders', 'SCHEDULER_REMINDER_MINUTES'),
+    'pass_deductions': ('deductions', 'SCHEDULER_DEDUCTION_MINUTES'),
+    'event_thank_yous': ('thank_yous', 'SCHEDULER_THANK_YOU_MINUTES'),
+}
+# In digest mode a single job covers all three, at the reminder interval so
+# reminders stay on time.
+DIGEST_JOBS = {'notification_digest': ('digest', 'SCHEDULER_REMINDER_MINUTES')}
+# Scheduled in both modes.
+COMMON_JOBS = {'waitlist_promotions': ('waitlist', 'SCHEDULER_WAITLIST_MINUTES')}
+
+_app = None
+_scheduler: Optional[BackgroundScheduler] = None
+_leader_lock = None
+_start_lock = threading.Lock()
+_started = False
+
+
+def run_scheduled_task(name: str) -> None:
+    """Job entry point; stored in the job table by reference, hence module-level."""
+    from .notification_tasks import run_digest, run_task
+    from .settings_cache import get_email_settings
+    from .waitlist import promote_all
+
+    with _app.app_context():
+        try:
+            if name == 'waitlist':
+                sent = promote_all()
+            elif name == 'digest':
+                sent = run_digest(datetime.utcnow(), get_email_settings())
+            else:
+                sent = run_task(name, datetime.utcnow(), get_email_settings())
+            logging.info('Ütemezett %s futás kész, elküldve: %s', name, sent)
+        finally:
+            db.session.remove()
+
+
+def _lock_path(app) -> Optional[str]:
+    with app.app_context():
+        return database_lock_path(db.engine, 'scheduler')
+
+
+def _start_scheduler(app) -> BackgroundScheduler:
+    global _app, _scheduler
+    _app = app
+    config = app.config
+    with app.app_context():
+        engine = db.engine
+    scheduler = BackgroundScheduler(
+        jobstores={'default': SQLAlchemyJobStore(engine=engine)},
+        timezone='UTC',
+    )
+    scheduler.start(paused=True)
+    jobs = {**(DIGEST_JOBS if config['NOTIFICATION_DIGEST'] else JOBS), **COMMON_JOBS}
+    # Missed runs are caught up with one run, unless they are older than
+    # the grace time.
+    options = {
+        'coalesce': True,
+        'max_instances': 1,
+        'misfire_grace_time': config['SCHEDULER_MISFIRE_GRACE_SECONDS'],
+    }
+    # Jobs persist in the database; drop the ones of the other mode.
+    for job in scheduler.get_jobs():
+        if job.id not in jobs:
+            job.remove()
+    for job_id, (task, interval_key) in jobs.items():
+        minutes = config[interval_key]
+        job = scheduler.get_job(job_id)
+        if job is None:
+            scheduler.add_job(
+                run_scheduled_task,
+                'interval',
+                args=[task],
+                id=job_id,
+                minutes=minutes,
+                replace_existing=False,
+                **options,
+            )
+            continue
+        # Keep the stored next run time, so the schedule survives restarts
+        # and a missed run fires on ``resume``; only a changed interval
+        # starts the schedule over.
+        if job.trigger.interval != timedelta(minutes=minutes):
+            job = scheduler.reschedule_job(job_id, trigger='interval', minutes=minutes)
+        if any(getattr(job, key) != value for key, value in options.items()):
+            scheduler.modify_job(job_id, **options)
+    scheduler.resume()
+    _scheduler = scheduler
+    logging.info('Értesítő ütemező elindult ebben a folyamatban.')
+    return scheduler
+
+
+def become_leader(app, wait: bool = True) -> Optional[BackgroundScheduler]:
+    """Start the scheduler once this process holds the leader lock.
+
+    With ``wait`` the call retries every ``SCHEDULER_LEADER_RETRY_SECONDS``
+    until the lock is free; otherwise it returns ``None`` right away. An
+    in-memory database cannot hold the job table, so no scheduler starts.
+    """
+    global _leader_lock
+    path = _lock_path(app)
+    if path is None:
+        logging.warning('Memóriabeli adatbázissal az ütemező nem indul el.')
+        return None
+    retry = app.config['SCHEDULER_LEADER_RETRY_SECONDS']
+    while _leader_lock is None:
+        _leader_lock = try_lock(path)
+        if _leader_lock is None:
+            if not wait:
+                return None
+            threading.Event().wait(retry)
+    return _scheduler or _start_scheduler(app)
+
+
+def start_scheduler_thread(app) -> None:
+    """Compete for scheduler leadership from a daemon thread, once per process."""
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(
+        target=become_leader, args=(app,), name='scheduler-leader', daemon=True
+    ).start()
@@ -0,0 +1,71 @@
+"""Process-wide cache of the ``EmailSettings`` row.
+
+Every notification reads the settings, often several times per email. The
+row is kept here as a read-only snapshot. Within
+``EMAIL_SETTINGS_CACHE_SECONDS`` of the last check the snapshot is returned
+without touching the database. After that, a single-integer read of
+``EmailSettings.version`` tells whether another process saved new settings.
+The admin settings page bumps the version on every save and drops this
+process's copy right away.
+"""
+
+from __future__ import annotations
+
+import time
+from types import SimpleNamespace
+from typing import NamedTuple, Optional
+
+from flask import current_app
+
+from . import db
+from .models import EmailSettings
+
+
+class _CacheEntry(NamedTuple):
+    settings: Optional[SimpleNamespace]
+    version: Optional[int]
+    checked_at: float
+
+
+# Keyed by database URL so apps bound to different databases in one process
+# do not share settings.
+_cache: dict = {}
+
+
+def _snapshot(row: Optional[EmailSettings]) -> Optional[SimpleNamespace]:
+    if row is None:
+        return None
+    return SimpleNamespace(
+        **{column.key: getattr(row, column.key) for column in EmailSettings.__table__.columns},
+        # Values computed from these settings (such as the escaped custom
+        # email texts); they are dropped together with the snapshot.
+        derived={},
+    )
+
+
+def get_email_settings() -> Optional[SimpleNamespace]:
+    """Return the current email settings as a snapshot, or ``None`` if unset."""
+    key = str(db.engine.url)
+    entry = _cache.get(key)
+    now = time.monotonic()
+    if entry is not None and now - entry.checked_at < current_app.config[
+        'EMAIL_SETTINGS_CACHE_SECONDS'
+    ]:
+        return entry.settings
+
+    version = db.session.scalar(
+        db.select(EmailSettings.version).order_by(EmailSettings.id).limit(1)
+    )
+    if entry is not None and version == entry.version:
+        _cache[key] = entry._replace(checked_at=now)
+        return entry.settings
+
+    row = db.session.scalar(db.select(EmailSettings).order_by(EmailSettings.id).limit(1))
+    settings = _snapshot(row)
+    _cache[key] = _CacheEntry(settings, row.version if row else None, now)
+    return settings
+
+
+def invalidate_email_settings() -> None:
+    """Forget the cached settings so the next read loads them again."""
+    _cache.pop(str(db.engine.url), None)
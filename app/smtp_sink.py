@@ -0,0 +1,122 @@
+"""A minimal SMTP server that accepts and discards every message.
+
+Stands in for the real mail server during development and benchmarks: it
+speaks just enough SMTP for ``smtplib`` (EHLO, AUTH PLAIN/LOGIN, MAIL, RCPT,
+DATA, RSET, NOOP, QUIT), accepts any credentials and can optionally wrap
+connections in TLS and delay every reply to imitate a remote server.
+"""
+
+from __future__ import annotations
+
+import socketserver
+import ssl
+import threading
+import time
+from typing import Optional
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def _reply(self, *lines: str) -> None:
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        for index, line in enumerate(lines):
+            separator = ' ' if index == len(lines) - 1 else '-'
+            code, _, text = line.partition(' ')
+            self.wfile.write(f'{code}{separator}{text}\r\n'.encode())
+        self.wfile.flush()
+
+    def _readline(self) -> Optional[str]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        return line.decode('utf-8', 'replace').rstrip('\r\n')
+
+    def handle(self) -> None:
+        self.server.connections += 1
+        self._reply('220 berlet-smtp-sink ESMTP')
+        while True:
+            line = self._readline()
+            if line is None:
+                return
+            verb, _, argument = line.partition(' ')
+            verb = verb.upper()
+            if verb == 'EHLO':
+                self._reply('250 berlet-smtp-sink', '250 AUTH PLAIN LOGIN', '250 8BITMIME')
+            elif verb == 'HELO':
+                self._reply('250 berlet-smtp-sink')
+            elif verb == 'AUTH':
+                if not self._auth(argument):
+                    return
+            elif verb in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self._reply('250 OK')
+            elif verb == 'DATA':
+                self._reply('354 End data with <CR><LF>.<CR><LF>')
+                if not self._read_data():
+                    return
+                self._reply('250 OK: queued')
+            elif verb == 'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('502 Command not implemented')
+
+    def _auth(self, argument: str) -> bool:
+        mechanism, _, initial = argument.partition(' ')
+        mechanism = mechanism.upper()
+        if mechanism == 'PLAIN' and not initial:
+            self._reply('334 ')
+            if self._readline() is None:
+                return False
+        elif mechanism == 'LOGIN':
+            for prompt in ('VXNlcm5hbWU6', 'UGFzc3dvcmQ6'):
+                if initial and prompt == 'VXNlcm5hbWU6':
+                    continue
+                self._reply(f'334 {prompt}')
+                if self._readline() is None:
+                    return False
+        elif mechanism != 'PLAIN':
+            self._reply('504 Unrecognized authentication type')
+            return True
+        self._reply('235 Authentication successful')
+        return True
+
+    def _read_data(self) -> bool:
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return False
+            if line in (b'.\r\n', b'.\n'):
+                self.server.messages += 1
+                return True
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """Threaded SMTP sink; ``messages`` and ``connections`` count what it saw."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 1025,
+        latency: float = 0.0,
+        ssl_context: Optional[ssl.SSLContext] = None,
+    ):
+        super().__init__((host, port), _SMTPHandler)
+        self.latency = latency
+        self.ssl_context = ssl_context
+        self.messages = 0
+        self.connections = 0
+
+    def get_request(self):
+        sock, address = super().get_request()
+        if self.ssl_context is not None:
+            sock = self.ssl_context.wrap_socket(sock, server_side=True)
+        return sock, address
+
+    def start(self) -> threading.Thread:
+        """Serve in a daemon thread and return it; stop with ``shutdown()``."""
+        thread = threading.Thread(target=self.serve_forever, name='smtp-sink', daemon=True)
+        thread.start()
+        return thread
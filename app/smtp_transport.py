@@ -0,0 +1,148 @@
+"""Reusable authenticated SMTP connections.
+
+``send_email`` used to connect, negotiate TLS and log in for every message.
+An ``SMTPTransport`` keeps that connection open across a batch, reconnects
+when the server drops it and starts a fresh one after
+``max_messages`` messages, which many providers enforce per session.
+"""
+
+from __future__ import annotations
+
+import logging
+import smtplib
+import ssl
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+
+# Errors after which the session is unusable but a new one may succeed.
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+_local = threading.local()
+
+
+class SMTPTransport:
+    """A lazily opened SMTP session reused for consecutive messages."""
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        use_ssl: bool = True,
+        starttls: bool = False,
+        timeout: float = 30,
+        max_messages: int = 100,
+        ssl_context: Optional[ssl.SSLContext] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.starttls = starttls
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self.ssl_context = ssl_context
+        self.connections_opened = 0
+        self._smtp = None
+        self._sent_on_connection = 0
+
+    @classmethod
+    def from_config(cls, config, username=None, password=None) -> 'SMTPTransport':
+        return cls(
+            config['SMTP_HOST'],
+            config['SMTP_PORT'],
+            username,
+            password,
+            use_ssl=config['SMTP_USE_SSL'],
+            starttls=config['SMTP_STARTTLS'],
+            timeout=config['SMTP_TIMEOUT'],
+            max_messages=config['SMTP_MAX_MESSAGES_PER_CONNECTION'],
+        )
+
+    def _connect(self) -> None:
+        context = self.ssl_context or ssl.create_default_context()
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(
+                self.host, self.port, timeout=self.timeout, context=context
+            )
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                smtp.starttls(context=context)
+        try:
+            if self.username and self.password:
+                smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        self._sent_on_connection = 0
+        self.connections_opened += 1
+
+    def send(self, message) -> None:
+        """Send an ``EmailMessage``, reconnecting once if the session was lost.
+
+        Any other SMTP error propagates after the connection is closed, so the
+        next message starts from a clean session.
+        """
+        if self._smtp is not None and self._sent_on_connection >= self.max_messages:
+            self.close()
+        for attempt in (1, 2):
+            if self._smtp is None:
+                self._connect()
+            try:
+                self._smtp.send_message(message)
+            except RECONNECT_ERRORS:
+                self._discard()
+                if attempt == 2:
+                    raise
+                logging.info('Az SMTP kapcsolat megszakadt, újracsatlakozás.')
+                continue
+            except Exception:
+                self.close()
+                raise
+            self._sent_on_connection += 1
+            return
+
+    def _discard(self) -> None:
+        if self._smtp is not None:
+            try:
+                self._smtp.close()
+            finally:
+                self._smtp = None
+
+    def close(self) -> None:
+        """End the SMTP session politely; a dead connection is just dropped."""
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._discard()
+
+    def __enter__(self) -> 'SMTPTransport':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def current_transport() -> Optional[SMTPTransport]:
+    """Return the transport bound to this thread by ``bind_transport``."""
+    return getattr(_local, 'transport', None)
+
+
+@contextmanager
+def bind_transport(transport: SMTPTransport):
+    """Make ``send_email`` in this thread reuse ``transport`` inside the block."""
+    previous = current_transport()
+    _local.transport = transport
+    try:
+        yield transport
+    finally:
+        _local.transport = previous
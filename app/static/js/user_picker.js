@@ -0,0 +1,47 @@
+// Typeahead for admin user pickers.
+//
+// Every ``input[data-user-picker]`` queries the search endpoint given in
+// ``data-url`` while the admin types, fills the ``<datalist>`` it points to
+// and writes the chosen user's ID into the form's hidden ``user_id`` field.
+(function () {
+    document.querySelectorAll('input[data-user-picker]').forEach(function (input) {
+        const hidden = input.form.querySelector('input[name="user_id"]');
+        const datalist = document.getElementById(input.getAttribute('list'));
+        let results = [];
+        let timer = null;
+
+        function syncHidden() {
+            const match = results.find(function (user) {
+                return user.username === input.value;
+            });
+            hidden.value = match ? match.id : '';
+        }
+
+        input.addEventListener('input', function () {
+            syncHidden();
+            clearTimeout(timer);
+            const query = input.value.trim();
+            if (!query) {
+                return;
+            }
+            timer = setTimeout(function () {
+                fetch(input.dataset.url + '?q=' + encodeURIComponent(query), {
+                    credentials: 'same-origin',
+                })
+                    .then(function (response) {
+                        return response.ok ? response.json() : [];
+                    })
+                    .then(function (users) {
+                        results = users;
+                        datalist.replaceChildren.apply(datalist, users.map(function (user) {
+                            const option = document.createElement('option');
+                            option.value = user.username;
+                            option.label = user.email;
+                            return option;
+                        }));
+                        syncHidden();
+                    });
+            }, 200);
+        });
+    });
+})();
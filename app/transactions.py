@@ -0,0 +1,47 @@
+"""Retry for short write transactions that lose the race for the SQLite lock.
+
+The busy timeout makes a competing writer wait, but SQLite cannot upgrade a
+transaction that has already read an older snapshot: it fails at once with
+``database is locked``. ``run_with_retry`` rolls back and runs the whole unit
+of work again on a fresh snapshot.
+"""
+
+import logging
+import random
+import time
+
+from flask import current_app
+from sqlalchemy.exc import OperationalError
+
+from . import db
+
+
+def is_busy_error(exc: OperationalError) -> bool:
+    message = str(exc.orig).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+
+def run_with_retry(work, attempts=None):
+    """Run ``work()`` and commit, retrying on SQLite busy errors.
+
+    ``work`` must redo every write of the transaction, since a retry starts
+    from a rolled-back session. Returns ``work``'s result; any other
+    exception rolls the transaction back and propagates.
+    """
+    config = current_app.config
+    attempts = attempts or config['DB_BUSY_RETRIES']
+    for attempt in range(1, attempts + 1):
+        try:
+            result = work()
+            db.session.commit()
+            return result
+        except OperationalError as exc:
+            db.session.rollback()
+            if attempt == attempts or not is_busy_error(exc):
+                raise
+            logging.info('Az adatbázis foglalt, újrapróbálás (%s).', attempt)
+            delay = config['DB_BUSY_RETRY_DELAY'] * 2 ** (attempt - 1)
+            time.sleep(delay * random.uniform(0.5, 1.5))
+        except Exception:
+            db.session.rollback()
+            raise
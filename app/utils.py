@@ -1,13 +1,16 @@
 import qrcode
 import io
 import base64
-import smtplib
+from contextlib import contextmanager
 from email.message import EmailMessage
 import os
 import logging
-import re
-from .email_templates import base_email_template
-from .models import EmailSettings
+from flask import current_app
+from .email_templates import render_email, text_to_markup, with_custom_text
+from .models import User, db
+from .settings_cache import get_email_settings
+from .email_backends import requires_login, transport_from_config
+from .smtp_transport import bind_transport, current_transport
 
 def generate_qr_code(data: str) -> str:
     qr = qrcode.QRCode(version=1, box_size=6, border=2)
@@ -21,17 +24,56 @@ def generate_qr_code(data: str) -> str:
 
     return f"data:image/png;base64,{qr_base64}"
 
-def send_email(subject, html_content, to_email):
-    """Send an email if credentials are configured.
+def user_prefix_filter(query: str):
+    """Return a filter matching users whose username or email starts with ``query``.
 
-    The function logs any exception and returns ``True`` on success and
-    ``False`` if the email could not be sent. This prevents unexpected
-    server errors when email credentials are missing or invalid.
+    The prefix match is written as a range on ``lower(column)`` so SQLite can
+    answer it from the expression indexes instead of scanning every user.
     """
+    low = db.func.lower(query)
 
-    msg = EmailMessage()
-    msg['Subject'] = subject
-    settings = EmailSettings.query.first()
+    def _prefix(column):
+        lowered = db.func.lower(column)
+        return db.and_(lowered >= low, lowered < low.concat('\U0010ffff'))
+
+    return db.or_(_prefix(User.username), _prefix(User.email))
+
+
+def search_users(query: str, limit: int = 10):
+    """Return at most ``limit`` users matching ``query`` for the user pickers."""
+    query = query.strip()
+    if not query:
+        return []
+    return (
+        User.query.filter(user_prefix_filter(query))
+        .order_by(User.username)
+        .limit(limit)
+        .all()
+    )
+
+
+def resolve_picked_user(user_id, username):
+    """Return the user chosen in a typeahead user picker.
+
+    The picker stores the selected user's ID in a hidden field; when the
+    script could not fill it in, fall back to an exact username match.
+    Returns ``None`` when the hidden ID belongs to another user than the
+    typed name, such as a stale pick after the text was retyped.
+    """
+    username = (username or '').strip()
+    if user_id:
+        user = db.session.get(User, user_id)
+        if user and username and user.username != username:
+            return None
+        return user
+    if username:
+        return User.query.filter_by(username=username).first()
+    return None
+
+
+def email_credentials():
+    """Return the sender address and password, preferring ``EmailSettings``."""
+    settings = get_email_settings()
     email_from = os.getenv('EMAIL_FROM')
     email_password = os.getenv('EMAIL_PASSWORD')
     if settings:
@@ -39,90 +81,133 @@ def send_email(subject, html_content, to_email):
             email_from = settings.email_from
         if settings.email_password:
             email_password = settings.email_password
+    return email_from, email_password
+
 
+def credentials_configured(email_from, email_password) -> bool:
+    """Whether ``email_from`` (and the password, if the backend logs in) is set."""
+    if not email_from:
+        return False
+    return bool(email_password) or not requires_login(current_app.config)
+
+
+def build_email_message(subject, html_content, email_from, to_email):
+    msg = EmailMessage()
+    msg['Subject'] = subject
     msg['From'] = email_from
     msg['To'] = to_email
     msg.set_content("Ez egy HTML formátumú e-mail.")
     msg.add_alternative(html_content, subtype='html')
+    return msg
+
+
+def send_email(subject, html_content, to_email):
+    """Send an email if credentials are configured.
+
+    The function logs any exception and returns ``True`` on success and
+    ``False`` if the email could not be sent. This prevents unexpected
+    server errors when email credentials are missing or invalid.
+    """
+
+    email_from, email_password = email_credentials()
+    msg = build_email_message(subject, html_content, email_from, to_email)
 
-    if not email_from or not email_password:
+    if not credentials_configured(email_from, email_password):
         logging.error('Email credentials are not configured.')
         return False
 
     try:
-        with smtplib.SMTP_SSL('smtp.gmail.com', 465) as smtp:
-            smtp.login(email_from, email_password)
-            smtp.send_message(msg)
+        transport = current_transport()
+        if transport is not None:
+            transport.send(msg)
+        else:
+            with transport_from_config(
+                current_app.config, email_from, email_password
+            ) as transport:
+                transport.send(msg)
         return True
     except Exception as exc:
         logging.error('Failed to send email: %s', exc)
         return False
 
 
-def send_event_email(event, subject, default_html, to_email):
-    settings = EmailSettings.query.first()
+@contextmanager
+def smtp_batch():
+    """Send every ``send_email`` in the block over one reused transport.
 
-    def _extract_content(html: str) -> str:
-        """Return the text content from a ``base_email_template`` HTML string."""
-        match = re.search(r"<p[^>]*>(.*?)</p>", html, re.DOTALL)
-        return match.group(1) if match else ""
+    The connection is opened on the first message, so an empty batch costs
+    nothing. Nested batches share the outer session.
+    """
+    if current_transport() is not None:
+        yield current_transport()
+        return
+    email_from, email_password = email_credentials()
+    with transport_from_config(
+        current_app.config, email_from, email_password
+    ) as transport, bind_transport(transport):
+        yield transport
+
+
+# Notification type -> whether its custom text follows the default content.
+# The enabled flag and the text are the ``<type>_enabled`` / ``<type>_text``
+# columns of ``EmailSettings``.
+EVENT_EMAILS = {
+    'user_created': False,
+    'user_deleted': False,
+    'pass_created': False,
+    'pass_deleted': False,
+    'pass_used': False,
+    'event_signup_user': False,
+    'event_signup_admin': False,
+    'event_unregister_user': False,
+    'event_unregister_admin': False,
+    'event_reminder': True,
+    'event_thank_you': False,
+}
+
+
+def _event_email_options(settings, event):
+    """Return ``(enabled, custom text, append)`` for the notification ``event``.
+
+    The escaped custom text is kept on the settings snapshot, so it is
+    prepared once per notification type and settings version.
+    """
+    options = settings.derived.get(event)
+    if options is None:
+        if event in EVENT_EMAILS:
+            text = (getattr(settings, f'{event}_text') or '').strip()
+            options = (
+                bool(getattr(settings, f'{event}_enabled')),
+                text_to_markup(text) if text else None,
+                EVENT_EMAILS[event],
+            )
+        else:
+            options = (False, None, False)
+        settings.derived[event] = options
+    return options
 
-    default_content = _extract_content(default_html)
 
-    if settings:
-        mapping = {
-            'user_created': (settings.user_created_enabled, settings.user_created_text, 'prepend'),
-            'user_deleted': (settings.user_deleted_enabled, settings.user_deleted_text, 'prepend'),
-            'pass_created': (settings.pass_created_enabled, settings.pass_created_text, 'prepend'),
-            'pass_deleted': (settings.pass_deleted_enabled, settings.pass_deleted_text, 'prepend'),
-            'pass_used': (settings.pass_used_enabled, settings.pass_used_text, 'prepend'),
-            'event_signup_user': (
-                settings.event_signup_user_enabled,
-                settings.event_signup_user_text,
-                'prepend',
-            ),
-            'event_signup_admin': (
-                settings.event_signup_admin_enabled,
-                settings.event_signup_admin_text,
-                'prepend',
-            ),
-            'event_unregister_user': (
-                settings.event_unregister_user_enabled,
-                settings.event_unregister_user_text,
-                'prepend',
-            ),
-            'event_unregister_admin': (
-                settings.event_unregister_admin_enabled,
-                settings.event_unregister_admin_text,
-                'prepend',
-            ),
-            'event_reminder': (
-                settings.event_reminder_enabled,
-                settings.event_reminder_text,
-                'append',
-            ),
-            'event_thank_you': (
-                settings.event_thank_you_enabled,
-                settings.event_thank_you_text,
-                'prepend',
-            ),
-        }
-        enabled, custom_text, order = mapping.get(event, (False, None, 'prepend'))
-        if not enabled:
-            return False
-        custom_text = (custom_text or '').strip()
-        if custom_text:
-            if order == 'append':
-                combined = f"{default_content}<br><br>{custom_text}"
-            else:
-                combined = f"{custom_text}<br><br>{default_content}"
-            html = base_email_template(subject, combined)
-        else:
-            html = default_html
-    else:
-        html = default_html
+def event_email_content(event, content):
+    """Return ``content`` with the configured custom text, or ``None`` if disabled.
 
-    return send_email(subject, html, to_email)
+    ``event`` names the notification type in ``EmailSettings``. Without
+    saved settings every notification is sent with its default content.
+    """
+    settings = get_email_settings()
+    if not settings:
+        return content
+    enabled, custom_text, append = _event_email_options(settings, event)
+    if not enabled:
+        return None
+    if custom_text:
+        return with_custom_text(content, custom_text, append)
+    return content
+
+
+def render_event_email(event, content):
+    """Return the HTML for a configurable notification, or ``None`` if disabled."""
+    content = event_email_content(event, content)
+    return render_email(content) if content is not None else None
 
 
 def send_weekly_reminders(app):
@@ -0,0 +1,130 @@
+"""Waitlist promotion off the request path.
+
+Cancellations call ``queue_promotion`` once they have committed and return
+right away; a background thread of the same web worker then fills the freed
+seats (``WAITLIST_WORKER``). Every promotion of an event runs under the
+``waitlist:<event id>`` lease, so promotions of one event never interleave,
+not even across workers, and the waitlist is served strictly in
+``created_at`` order. An event whose lease is busy is retried after
+``WAITLIST_RETRY_SECONDS``: the run holding it may have counted the seats
+before the cancellation committed.
+
+The scheduler's ``waitlist_promotions`` job (``promote_all``) sweeps every
+upcoming event with free seats and waiting users, which covers promotions
+lost when a process exits before handling its queue.
+"""
+
+import logging
+import threading
+from datetime import datetime
+from typing import Optional
+
+from flask import current_app
+
+from . import db
+from .leases import acquire_lease
+from .models import Event, EventWaitlist
+
+
+_pending = set()
+_pending_lock = threading.Lock()
+_wakeup = threading.Event()
+_worker_lock = threading.Lock()
+_worker_started = False
+# Without queued work the worker still wakes up now and then to notice ``stop``.
+_IDLE_SECONDS = 60
+
+
+def queue_promotion(event_id: int) -> None:
+    """Fill the free seats of ``event_id`` from its waitlist in the background.
+
+    Call after the commit that freed the seats. Without ``WAITLIST_WORKER``
+    the promotion runs right away instead.
+    """
+    if not current_app.config['WAITLIST_WORKER']:
+        promote_event(event_id)
+        return
+    with _pending_lock:
+        _pending.add(event_id)
+    _wakeup.set()
+
+
+def promote_event(event_id: int) -> Optional[int]:
+    """Promote under the event's lease; ``None`` if another run holds it."""
+    from .routes.event_routes import _promote_waitlist
+
+    lease = acquire_lease(
+        f'waitlist:{event_id}', current_app.config['WAITLIST_LEASE_SECONDS']
+    )
+    if lease is None:
+        return None
+    try:
+        return _promote_waitlist(event_id)
+    finally:
+        lease.release()
+
+
+def promote_all() -> int:
+    """Promote on every upcoming event with free seats and a waitlist."""
+    event_ids = db.session.scalars(
+        db.select(Event.id)
+        .where(
+            Event.start_time > datetime.now(),
+            Event.active_count < Event.capacity,
+            db.select(EventWaitlist.id)
+            .where(EventWaitlist.event_id == Event.id)
+            .exists(),
+        )
+        .order_by(Event.start_time)
+    ).all()
+    promoted = 0
+    for event_id in event_ids:
+        promoted += promote_event(event_id) or 0
+    return promoted
+
+
+def _take_pending() -> list:
+    with _pending_lock:
+        event_ids = sorted(_pending)
+        _pending.clear()
+    return event_ids
+
+
+def run_worker(app, stop=None) -> None:
+    """Promote queued events until ``stop`` is set."""
+    retry = app.config['WAITLIST_RETRY_SECONDS']
+    busy = []
+    while not (stop and stop.is_set()):
+        # Sleep until a cancellation queues an event, or only briefly while
+        # an event waits for its lease.
+        _wakeup.wait(retry if busy else _IDLE_SECONDS)
+        _wakeup.clear()
+        event_ids = sorted(set(_take_pending()) | set(busy))
+        busy = []
+        with app.app_context():
+            for event_id in event_ids:
+                try:
+                    promoted = promote_event(event_id)
+                except Exception:
+                    logging.exception('A várólista léptetése sikertelen: %s', event_id)
+                    db.session.rollback()
+                    continue
+                if promoted is None:
+                    busy.append(event_id)
+                elif promoted:
+                    logging.info(
+                        'Várólistáról bekerült %s fő az eseményre: %s', promoted, event_id
+                    )
+            db.session.remove()
+
+
+def start_worker_thread(app) -> None:
+    """Start the background promotion thread once per process."""
+    global _worker_started
+    with _worker_lock:
+        if _worker_started:
+            return
+        _worker_started = True
+    threading.Thread(
+        target=run_worker, args=(app,), name='waitlist-promotion', daemon=True
+    ).start()
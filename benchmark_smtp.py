@@ -0,0 +1,116 @@
+"""Compare per-message send time with and without SMTP connection reuse.
+
+Starts a local SMTP sink (``app.smtp_sink``) and sends the same batch of
+messages twice: once opening and authenticating a new session per message,
+the way ``send_email`` used to, and once through a single ``SMTPTransport``.
+``--latency`` delays every server reply to imitate a remote server and
+``--tls`` wraps the sink in TLS with a throw-away self-signed certificate
+(needs the ``openssl`` command).
+
+    python benchmark_smtp.py --messages 200 --latency 0.01 --tls
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+import time
+from email.message import EmailMessage
+
+from app.smtp_sink import SMTPSink
+from app.smtp_transport import SMTPTransport
+
+
+def _self_signed_context(directory: str):
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.run(
+        [
+            'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+            '-keyout', keyfile, '-out', certfile, '-days', '1',
+            '-subj', '/CN=localhost',
+        ],
+        check=True,
+        capture_output=True,
+    )
+    server = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server.load_cert_chain(certfile, keyfile)
+    client = ssl.create_default_context()
+    client.check_hostname = False
+    client.verify_mode = ssl.CERT_NONE
+    return server, client
+
+
+def _message(index: int) -> EmailMessage:
+    msg = EmailMessage()
+    msg['Subject'] = f'Esemény emlékeztető #{index}'
+    msg['From'] = 'bench@example.com'
+    msg['To'] = f'user{index}@example.com'
+    msg.set_content('Ez egy HTML formátumú e-mail.')
+    msg.add_alternative(f'<p>Emlékeztető #{index}</p>', subtype='html')
+    return msg
+
+
+def run(reuse: bool, sink: SMTPSink, client_context, args) -> float:
+    host, port = sink.server_address
+
+    def transport():
+        return SMTPTransport(
+            host,
+            port,
+            'bench@example.com',
+            'secret',
+            use_ssl=client_context is not None,
+            max_messages=args.max_per_connection,
+            ssl_context=client_context,
+        )
+
+    started = time.perf_counter()
+    if reuse:
+        with transport() as shared:
+            for index in range(args.messages):
+                shared.send(_message(index))
+    else:
+        for index in range(args.messages):
+            with transport() as single:
+                single.send(_message(index))
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--max-per-connection', type=int, default=100)
+    parser.add_argument('--tls', action='store_true')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='berlet-smtp-bench-')
+    try:
+        server_context = client_context = None
+        if args.tls:
+            server_context, client_context = _self_signed_context(directory)
+        sink = SMTPSink(port=0, latency=args.latency, ssl_context=server_context)
+        sink.start()
+        try:
+            for reuse in (False, True):
+                connections = sink.connections
+                elapsed = run(reuse, sink, client_context, args)
+                label = 'újrahasznált' if reuse else 'üzenetenként'
+                print(
+                    f"{label:>13}: {elapsed / args.messages * 1000:7.2f} ms/üzenet, "
+                    f"{sink.connections - connections} kapcsolat"
+                )
+        finally:
+            sink.shutdown()
+            sink.server_close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
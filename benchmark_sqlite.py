@@ -0,0 +1,178 @@
+"""Compare read/write throughput with the SQLite tuning profile on and off.
+
+Seeds a throw-away copy of the schema, then runs concurrent reader threads
+(event listing lookups) and writer threads (registration inserts with the
+``active_count`` update) against it for a fixed time with each profile.
+
+    python benchmark_sqlite.py --readers 8 --writers 4 --seconds 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from app import db, models  # noqa: F401  (registers the tables)
+from app.sqlite_tuning import DEFAULT_ENGINE_OPTIONS, DEFAULT_PRAGMAS, apply_profile
+
+
+def _seed(engine, users: int, events: int, registrations: int) -> None:
+    db.metadata.create_all(bind=engine)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO user (username, email, password_hash, role, is_blacklisted) "
+                "VALUES (:username, :email, 'x', 'user', 0)"
+            ),
+            [
+                {'username': f'user{i}', 'email': f'user{i}@example.com'}
+                for i in range(users)
+            ],
+        )
+        conn.execute(
+            text(
+                "INSERT INTO event (name, start_time, end_time, capacity, color, "
+                "is_final_event, active_count) "
+                "VALUES (:name, :start, :end, 100000, 'blue', 0, 0)"
+            ),
+            [
+                {
+                    'name': f'Edzés {i}',
+                    'start': now + timedelta(hours=i),
+                    'end': now + timedelta(hours=i, minutes=60),
+                }
+                for i in range(events)
+            ],
+        )
+        conn.execute(
+            text(
+                "INSERT INTO event_registration (event_id, user_id, registration_type, status, created_at) "
+                "VALUES (:event_id, :user_id, 'single', :status, :created_at)"
+            ),
+            [
+                {
+                    'event_id': random.randint(1, events),
+                    'user_id': random.randint(1, users),
+                    'status': random.choice(('active', 'cancelled')),
+                    'created_at': now,
+                }
+                for _ in range(registrations)
+            ],
+        )
+        conn.execute(
+            text(
+                "UPDATE event SET active_count = (SELECT COUNT(*) FROM event_registration "
+                "WHERE event_id = event.id AND status = 'active')"
+            )
+        )
+
+
+def _reader(engine, events: int, stop: threading.Event, stats: dict) -> None:
+    while not stop.is_set():
+        user_id = random.randint(1, 1000)
+        try:
+            with engine.connect() as conn:
+                conn.execute(
+                    text(
+                        "SELECT id, capacity - active_count FROM event "
+                        "ORDER BY start_time LIMIT 50"
+                    )
+                ).all()
+                conn.execute(
+                    text(
+                        "SELECT event_id, status FROM event_registration "
+                        "WHERE user_id = :user_id AND status = 'active'"
+                    ),
+                    {'user_id': user_id},
+                ).all()
+            stats['reads'] += 1
+        except OperationalError:
+            stats['errors'] += 1
+
+
+def _writer(engine, events: int, stop: threading.Event, stats: dict) -> None:
+    while not stop.is_set():
+        event_id = random.randint(1, events)
+        try:
+            with engine.begin() as conn:
+                conn.execute(
+                    text(
+                        "INSERT INTO event_registration (event_id, user_id, registration_type, status, created_at) "
+                        "VALUES (:event_id, :user_id, 'single', 'active', :now)"
+                    ),
+                    {
+                        'event_id': event_id,
+                        'user_id': random.randint(1, 1000),
+                        'now': datetime.utcnow(),
+                    },
+                )
+                conn.execute(
+                    text("UPDATE event SET active_count = active_count + 1 WHERE id = :id"),
+                    {'id': event_id},
+                )
+            stats['writes'] += 1
+        except OperationalError:
+            stats['errors'] += 1
+
+
+def run(tuned: bool, args) -> dict:
+    directory = tempfile.mkdtemp(prefix='berlet-bench-')
+    url = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    if tuned:
+        engine = create_engine(url, **DEFAULT_ENGINE_OPTIONS)
+        apply_profile(engine, DEFAULT_PRAGMAS)
+    else:
+        engine = create_engine(url, connect_args={'check_same_thread': False})
+    _seed(engine, 1000, args.events, args.registrations)
+
+    stats = {'reads': 0, 'writes': 0, 'errors': 0}
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=_reader, args=(engine, args.events, stop, stats))
+        for _ in range(args.readers)
+    ] + [
+        threading.Thread(target=_writer, args=(engine, args.events, stop, stats))
+        for _ in range(args.writers)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    shutil.rmtree(directory, ignore_errors=True)
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--registrations', type=int, default=50000)
+    args = parser.parse_args()
+
+    for tuned in (False, True):
+        stats = run(tuned, args)
+        label = 'hangolt' if tuned else 'alapértelmezett'
+        print(
+            f"{label:>16}: {stats['reads'] / args.seconds:8.1f} olvasás/s, "
+            f"{stats['writes'] / args.seconds:8.1f} írás/s, "
+            f"{stats['errors']} zárolási hiba"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Check that the admin events page issues the same number of queries at any size.
+
+Seeds a throw-away database for every size with that many upcoming events,
+each with that many registrations and a few waitlist entries, then renders
+``/admin/events`` as an admin and counts the SQL statements of the second
+request, so one-off work of the first request is left out. The script exits
+with status 1 if the counts differ, for example because the page went back
+to loading registrations or users once per event.
+
+    python check_admin_events_queries.py --sizes 5 10 25
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import event as sa_event
+
+from app import create_app, db
+from app.models import Event, EventRegistration, EventWaitlist, User
+
+WAITLIST_PER_EVENT = 3
+
+
+def _seed(size: int) -> int:
+    admin = User(username='admin', email='admin@example.com', password_hash='x', role='admin')
+    members = [
+        User(
+            username=f'tag{index}',
+            email=f'tag{index}@example.com',
+            password_hash='x',
+            role='user',
+        )
+        for index in range(size + WAITLIST_PER_EVENT)
+    ]
+    db.session.add(admin)
+    db.session.add_all(members)
+    db.session.flush()
+    start = datetime.now() + timedelta(days=2)
+    for index in range(size):
+        event = Event(
+            name=f'Edzés {index}',
+            start_time=start + timedelta(hours=index),
+            end_time=start + timedelta(hours=index + 1),
+            capacity=size,
+            active_count=size,
+        )
+        db.session.add(event)
+        db.session.flush()
+        db.session.add_all(
+            EventRegistration(event_id=event.id, user_id=member.id)
+            for member in members[:size]
+        )
+        db.session.add_all(
+            EventWaitlist(event_id=event.id, user_id=member.id)
+            for member in members[size:]
+        )
+    db.session.commit()
+    return admin.id
+
+
+def count_queries(size: int) -> tuple:
+    directory = tempfile.mkdtemp(prefix='berlet-admin-events-check-')
+    try:
+        app = create_app(
+            {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(directory, 'check.db')}"}
+        )
+        with app.app_context():
+            admin_id = _seed(size)
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(admin_id)
+            session['_fresh'] = True
+
+        client.get('/admin/events')
+
+        # The test client handles the request in this thread; statements of
+        # background threads started by the app are not the page's.
+        thread = threading.get_ident()
+        with app.app_context():
+            statements = []
+            sa_event.listen(
+                db.engine,
+                'before_cursor_execute',
+                lambda *args: threading.get_ident() == thread
+                and statements.append(args[2]),
+            )
+            response = client.get('/admin/events')
+            db.engine.dispose()
+        listed = response.get_data(as_text=True).count('id="event-')
+        return response.status_code, listed, len(statements)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5, 10, 25])
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes:
+        status, listed, statements = count_queries(size)
+        if status != 200 or listed != size:
+            print(f'HIBA: {size} esemény helyett {listed} látszik (HTTP {status}).')
+            sys.exit(1)
+        results[size] = statements
+        print(f'{size:>6} esemény × {size} jelentkezés: {statements} SQL utasítás')
+
+    if len(set(results.values())) != 1:
+        print('HIBA: a lekérdezések száma az események számától függ.')
+        sys.exit(1)
+    print('OK: a lekérdezések száma független az események számától.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""Check that a notification run issues the same number of queries at any batch size.
+
+Seeds a throw-away database for every batch size, with one reminder, one
+pass deduction and one thank-you email per user. It then runs
+``run_notifications`` against a local SMTP sink (``app.smtp_sink``) and
+counts the SQL statements. The chunk size is raised to the largest batch,
+so each task handles its batch in a single chunk. The script exits with
+status 1 if the counts differ.
+
+    python check_notification_queries.py --sizes 10 100 500
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import event as sa_event
+
+from app import create_app, db
+from app.models import (
+    EmailSettings,
+    Event,
+    EventRegistration,
+    Pass,
+    PassUsage,
+    User,
+    reminder_due_time,
+)
+from app.notification_tasks import run_notifications
+from app.settings_cache import get_email_settings
+from app.smtp_sink import SMTPSink
+
+
+def _seed(users: int, now: datetime) -> None:
+    db.session.add(
+        EmailSettings(
+            email_from='berlet@example.com',
+            email_password='secret',
+            event_reminder_enabled=True,
+            pass_used_enabled=True,
+            event_thank_you_enabled=True,
+        )
+    )
+    upcoming = Event(
+        name='Holnapi edzés',
+        start_time=now + timedelta(hours=12),
+        end_time=now + timedelta(hours=13),
+        capacity=users,
+    )
+    deducted = Event(
+        name='Bérletes edzés',
+        start_time=now - timedelta(hours=3),
+        end_time=now - timedelta(hours=2),
+        capacity=users,
+    )
+    finished = Event(
+        name='Nyílt edzés',
+        start_time=now - timedelta(hours=5),
+        end_time=now - timedelta(hours=4),
+        capacity=users,
+    )
+    db.session.add_all([upcoming, deducted, finished])
+    db.session.flush()
+    for index in range(users):
+        user = User(
+            username=f'tag{index}',
+            email=f'tag{index}@example.com',
+            password_hash='x',
+            role='user',
+        )
+        db.session.add(user)
+        db.session.flush()
+        pass_ = Pass(
+            type='10 alkalmas',
+            end_date=(now + timedelta(days=30)).date(),
+            total_uses=10,
+            used=1,
+            user_id=user.id,
+        )
+        db.session.add(pass_)
+        db.session.flush()
+        usage = PassUsage(pass_id=pass_.id)
+        db.session.add(usage)
+        db.session.flush()
+        db.session.add_all(
+            [
+                EventRegistration(
+                    event_id=upcoming.id,
+                    user_id=user.id,
+                    reminder_due_at=reminder_due_time(upcoming.start_time),
+                ),
+                EventRegistration(
+                    event_id=deducted.id,
+                    user_id=user.id,
+                    registration_type='pass',
+                    pass_id=pass_.id,
+                    pass_usage_id=usage.id,
+                ),
+                EventRegistration(event_id=finished.id, user_id=user.id),
+            ]
+        )
+    db.session.commit()
+
+
+def count_queries(users: int, chunk_size: int, sink: SMTPSink) -> tuple:
+    directory = tempfile.mkdtemp(prefix='berlet-notify-check-')
+    try:
+        host, port = sink.server_address
+        app = create_app(
+            {
+                'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(directory, 'check.db')}",
+                'EMAIL_OUTBOX_WORKER': False,
+                'SMTP_HOST': host,
+                'SMTP_PORT': port,
+                'SMTP_USE_SSL': False,
+                'EMAIL_RATE_LIMIT_PER_SECOND': 0,
+                'NOTIFICATION_CHUNK_SIZE': chunk_size,
+                # Large batches run longer than the default cache window, and
+                # the settings version recheck would add a statement to them.
+                'EMAIL_SETTINGS_CACHE_SECONDS': 3600,
+            }
+        )
+        with app.app_context():
+            now = datetime.utcnow()
+            _seed(users, now)
+            db.session.expunge_all()
+            settings = get_email_settings()
+
+            statements = []
+            sa_event.listen(
+                db.engine,
+                'before_cursor_execute',
+                lambda *args: statements.append(args[2]),
+            )
+            counts = run_notifications(now, settings)
+            db.engine.dispose()
+        return counts, len(statements)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500])
+    args = parser.parse_args()
+
+    sink = SMTPSink(port=0)
+    sink.start()
+    try:
+        results = {}
+        for users in args.sizes:
+            counts, statements = count_queries(users, max(args.sizes), sink)
+            results[users] = statements
+            print(f'{users:>6} felhasználó: elküldve {counts}, {statements} SQL utasítás')
+    finally:
+        sink.shutdown()
+        sink.server_close()
+
+    if len(set(results.values())) != 1:
+        print('HIBA: a lekérdezések száma a köteg méretétől függ.')
+        sys.exit(1)
+    print('OK: a lekérdezések száma független a köteg méretétől.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Check that the scheduler keeps its schedule across restarts.
+
+Starts the scheduler in a child process against a throw-away file database
+with a short reminder interval, stops it before the first run, waits for
+several intervals and starts it again in a new process. The missed runs
+must be caught up with exactly one run as soon as the scheduler is back,
+counted up to the next regular run; a scheduler that starts its jobs over
+runs nothing in that time. The script exits with status 1 otherwise.
+
+    python check_scheduler_catchup.py --interval 3
+"""
+
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+
+def _run_leader(database: str, interval: float, seconds: float) -> None:
+    """Child process: lead the scheduler and print the reminder runs.
+
+    Runs for ``seconds``, or with ``0`` until just before the next regular
+    reminder run.
+    """
+    from app import create_app
+    from app.scheduler import become_leader
+
+    class _Counter(logging.Handler):
+        runs = 0
+
+        def emit(self, record):
+            if record.msg.startswith('Ütemezett') and record.args[0] == 'reminders':
+                _Counter.runs += 1
+
+    logging.getLogger().addHandler(_Counter())
+    logging.getLogger().setLevel(logging.INFO)
+
+    app = create_app(
+        {
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database}',
+            'EMAIL_OUTBOX_WORKER': False,
+            'WAITLIST_WORKER': False,
+            'SCHEDULER_ENABLED': False,
+            'SCHEDULER_REMINDER_MINUTES': interval / 60,
+            'SCHEDULER_DEDUCTION_MINUTES': 60,
+            'SCHEDULER_THANK_YOU_MINUTES': 60,
+            'SCHEDULER_WAITLIST_MINUTES': 60,
+        }
+    )
+    scheduler = become_leader(app, wait=False)
+    if not seconds:
+        # Let a catch-up run start, then stop short of the next regular one.
+        time.sleep(0.5)
+        next_run = scheduler.get_job('event_reminders').next_run_time
+        seconds = (next_run - datetime.now(timezone.utc)).total_seconds() - 0.2
+    time.sleep(max(seconds, 0))
+    scheduler.shutdown()
+    print(_Counter.runs)
+
+
+def _start(database: str, interval: float, seconds: float) -> int:
+    result = subprocess.run(
+        [
+            sys.executable,
+            __file__,
+            '--leader',
+            database,
+            '--interval',
+            str(interval),
+            '--seconds',
+            str(seconds),
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return int(result.stdout.split()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--interval', type=float, default=3, help='seconds')
+    parser.add_argument('--missed', type=int, default=3)
+    parser.add_argument('--leader', help=argparse.SUPPRESS)
+    parser.add_argument('--seconds', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.leader:
+        _run_leader(args.leader, args.interval, args.seconds)
+        return
+
+    directory = tempfile.mkdtemp(prefix='berlet-scheduler-check-')
+    try:
+        database = os.path.join(directory, 'check.db')
+        before = _start(database, args.interval, args.interval / 3)
+        time.sleep(args.interval * args.missed)
+        after = _start(database, args.interval, 0)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(
+        f'Első indítás: {before} futás; {args.missed} kihagyott időköz után '
+        f'az újraindítás: {after} futás.'
+    )
+    if before != 0 or after != 1:
+        print('HIBA: a kihagyott futások nem egyetlen pótló futásként jöttek.')
+        sys.exit(1)
+    print('OK: az ütemezés túléli az újraindítást, a kimaradt futás egyszer pótlódik.')
+
+
+if __name__ == '__main__':
+    main()
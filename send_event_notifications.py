@@ -1,17 +1,17 @@
-"""Send event reminder, pass deduction, and thank you emails."""
+"""Send event reminder, pass deduction, and thank you emails once.
+
+The web app schedules these itself (see ``app.scheduler``); this script is
+for cron setups that run with ``SCHEDULER_ENABLED=0``.
+"""
 
 from __future__ import annotations
 
 import logging
 from datetime import datetime
 
-from app import create_app, db
-from app.models import EmailSettings
-from app.notification_tasks import (
-    send_event_reminders,
-    send_event_thank_you_notifications,
-    send_pass_deduction_notifications,
-)
+from app import create_app
+from app.settings_cache import get_email_settings
+from app.notification_tasks import run_notifications
 
 
 def main() -> None:
@@ -19,11 +19,8 @@ def main() -> None:
     app = create_app()
     with app.app_context():
         now = datetime.utcnow()
-        settings = EmailSettings.query.first()
-        reminders = send_event_reminders(now, settings)
-        deductions = send_pass_deduction_notifications(now, settings)
-        thank_yous = send_event_thank_you_notifications(now, settings)
-        db.session.commit()
+        settings = get_email_settings()
+        reminders, deductions, thank_yous = run_notifications(now, settings)
         logging.info(
             "Esemény emlékeztetők kiküldve: %s, levonási értesítők: %s, köszönő üzenetek: %s",
             reminders,
@@ -0,0 +1,174 @@
+"""Check that concurrent signups never overbook an event or a pass.
+
+Seeds a throw-away database with one small event and many users, then lets
+every user POST to ``/events/signup/<id>`` at the same moment from its own
+thread. Afterwards the active registrations, ``Event.active_count`` and the
+capacity must agree. A second round fires the same number of simultaneous
+admin check-ins (``/use_pass/<id>``) at a pass with a few uses left; its
+``used`` counter and ``PassUsage`` rows must stop at ``total_uses``. The
+script exits with status 1 if anything was overbooked or a counter drifted.
+
+    python stress_event_signup.py --users 300 --capacity 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+from app import create_app, db
+from app.models import Event, EventRegistration, Pass, PassUsage, User
+
+
+def _seed(users: int, capacity: int) -> tuple:
+    start = datetime.now() + timedelta(days=2)
+    event = Event(
+        name='Népszerű edzés',
+        start_time=start,
+        end_time=start + timedelta(hours=1),
+        capacity=capacity,
+    )
+    db.session.add(event)
+    members = [
+        User(
+            username=f'tag{index}',
+            email=f'tag{index}@example.com',
+            password_hash='x',
+            role='user',
+        )
+        for index in range(users)
+    ]
+    db.session.add_all(members)
+    db.session.commit()
+    return event.id, [member.id for member in members]
+
+
+def _create_app(directory: str, users: int):
+    return create_app(
+        {
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(directory, 'stress.db')}",
+            'EMAIL_OUTBOX_WORKER': False,
+            'SCHEDULER_ENABLED': False,
+            'WTF_CSRF_ENABLED': False,
+            'SQLALCHEMY_ENGINE_OPTIONS': {'pool_size': users, 'max_overflow': 0},
+        }
+    )
+
+
+def _fire(app, requests) -> Counter:
+    """Send every ``(user_id, method, url)`` request at the same moment."""
+    barrier = threading.Barrier(len(requests))
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def _send(user_id: int, method: str, url: str) -> None:
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        barrier.wait()
+        try:
+            status = client.open(url, method=method).status_code
+        except Exception as exc:
+            status = type(exc).__name__
+        with lock:
+            statuses[status] += 1
+
+    threads = [threading.Thread(target=_send, args=request) for request in requests]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return statuses
+
+
+def run(users: int, capacity: int) -> bool:
+    directory = tempfile.mkdtemp(prefix='berlet-signup-stress-')
+    try:
+        app = _create_app(directory, users)
+        with app.app_context():
+            event_id, user_ids = _seed(users, capacity)
+
+        statuses = _fire(
+            app, [(user_id, 'POST', f'/events/signup/{event_id}') for user_id in user_ids]
+        )
+
+        with app.app_context():
+            active = EventRegistration.query.filter_by(
+                event_id=event_id, status='active'
+            ).count()
+            counter = db.session.get(Event, event_id).active_count
+            db.engine.dispose()
+
+        print(
+            f'{users} egyidejű jelentkezés, {capacity} hely: '
+            f'{active} aktív jelentkezés, active_count={counter}, válaszok: {dict(statuses)}'
+        )
+        return active == counter <= capacity and active == min(users, capacity)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def run_checkins(requests: int, uses_left: int) -> bool:
+    directory = tempfile.mkdtemp(prefix='berlet-checkin-stress-')
+    try:
+        app = _create_app(directory, requests)
+        with app.app_context():
+            admin = User(
+                username='admin', email='admin@example.com', password_hash='x', role='admin'
+            )
+            member = User(
+                username='tag', email='tag@example.com', password_hash='x', role='user'
+            )
+            db.session.add_all([admin, member])
+            db.session.flush()
+            pass_ = Pass(
+                type='10 alkalmas',
+                end_date=(datetime.now() + timedelta(days=30)).date(),
+                total_uses=10,
+                used=10 - uses_left,
+                user_id=member.id,
+            )
+            db.session.add(pass_)
+            db.session.commit()
+            admin_id, pass_id = admin.id, pass_.id
+
+        statuses = _fire(app, [(admin_id, 'GET', f'/use_pass/{pass_id}')] * requests)
+
+        with app.app_context():
+            used = db.session.get(Pass, pass_id).used
+            usages = PassUsage.query.filter_by(pass_id=pass_id).count()
+            db.engine.dispose()
+
+        print(
+            f'{requests} egyidejű bérlethasználat, {uses_left} szabad alkalom: '
+            f'used={used}/10, {usages} PassUsage sor, válaszok: {dict(statuses)}'
+        )
+        return used == 10 and usages == uses_left
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--capacity', type=int, default=5)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    results = [run(args.users, args.capacity) for _ in range(args.rounds)]
+    results += [run_checkins(args.users, args.capacity) for _ in range(args.rounds)]
+    if not all(results):
+        print('HIBA: túlfoglalás, vagy egy számláló nem egyezik.')
+        sys.exit(1)
+    print('OK: sem az esemény, sem a bérlet nem lett túlfoglalva.')
+
+
+if __name__ == '__main__':
+    main()